@@ -2,15 +2,34 @@
 Configuration settings for Smart Query Builder
 """
 import os
+import tempfile
 
 class Settings:
     # API Keys
     ANTHROPIC_API_KEY: str = os.getenv("ANTHROPIC_API_KEY", "your-api-key-here")
+    SERP_API_KEY: str = os.getenv("SERP_API_KEY")
 
     # Redis Configuration
-    REDIS_HOST: str = "localhost"
-    REDIS_PORT: int = 6379
-    REDIS_DB: int = 0
+    REDIS_HOST: str = os.getenv("REDIS_HOST", "localhost")
+    REDIS_PORT: int = int(os.getenv("REDIS_PORT", "6379"))
+    REDIS_DB: int = int(os.getenv("REDIS_DB", "0"))
+    REDIS_TIMEOUT: float = 0.5
+    REDIS_RETRY_SECONDS: float = 30.0  # After a Redis error, skip it this long
+
+    # Response Cache Settings (seconds)
+    CACHE_TTL: int = 86400  # 24 hours for plain industry/region requests
+    CACHE_TTL_FILTERED: int = 3600  # 1 hour when includes/excludes are set
+
+    # SERP context disk cache (needs diskcache) - shared by workers, survives restarts
+    SERP_DISK_CACHE_DIR: str = os.getenv(
+        "SERP_DISK_CACHE_DIR", os.path.join(tempfile.gettempdir(), "smart-query-serp")
+    )
+    SERP_DISK_CACHE_SIZE: int = 512 * 1024 * 1024  # bytes
+
+    # Semantic Cache Settings (needs sentence-transformers + faiss-cpu)
+    SEMANTIC_CACHE_MODEL: str = "all-MiniLM-L6-v2"
+    SEMANTIC_CACHE_THRESHOLD: float = 0.92
+    SEMANTIC_CACHE_MAX_ENTRIES: int = 10000
 
     # Query Builder Settings
     DEFAULT_TOP_K: int = 25
@@ -31,9 +50,39 @@ class Settings:
     # Business TLDs
     BUSINESS_TLDS = [".com", ".org", ".net", ".co"]
 
+    # Shared HTTP client pool (Claude + SERP)
+    HTTP_MAX_CONNECTIONS: int = 200
+    HTTP_MAX_KEEPALIVE: int = 50
+    HTTP_TIMEOUT: float = 30.0
+
+    # Default executor for asyncio.to_thread, per worker process
+    THREAD_POOL_SIZE: int = int(os.getenv("THREAD_POOL_SIZE", "64"))
+
+    # Per-step deadlines (seconds) - a slow step degrades instead of hanging
+    SERP_TIMEOUT: float = 2.5  # Give up on SERP context and generate without it
+    CLAUDE_TIMEOUT: float = 25.0  # Give up on Claude and return fallback queries
+
     # Claude Settings
-    CLAUDE_MODEL: str = "claude-3-haiku-20240307"
-    CLAUDE_MAX_TOKENS: int = 2000
+    # Use correct model name - claude-sonnet-4-5 is the latest (Sep 2025)
+    # Alternative: claude-sonnet-4 (May 2025) or claude-3-5-sonnet-20241022 (Oct 2024)
+    CLAUDE_MODEL: str = os.getenv("CLAUDE_MODEL", "claude-sonnet-4")
+    # Model tiers: generation runs on the fast tier and falls forward to the
+    # smart tier when it returns too few usable queries
+    CLAUDE_MODEL_FAST: str = os.getenv("CLAUDE_MODEL_FAST", "claude-3-5-haiku-latest")
+    CLAUDE_MODEL_SMART: str = os.getenv("CLAUDE_MODEL_SMART", CLAUDE_MODEL)
+    CLAUDE_MAX_TOKENS: int = 4096  # Ceiling per call; actual budget is sized to the query count
+    CLAUDE_TOKENS_PER_QUERY: int = 40  # One quoted query plus JSON punctuation, with headroom
+    CLAUDE_MAX_RETRIES: int = 2  # The SDK backs off exponentially on 429/5xx
+    CLAUDE_MAX_CONCURRENCY: int = int(os.getenv("CLAUDE_MAX_CONCURRENCY", "16"))  # In-flight calls per worker
+    CLAUDE_REQUEST_TIMEOUT: float = 60.0  # SDK default is 600s
+    CLAUDE_HEDGE_DELAY: float = float(os.getenv("CLAUDE_HEDGE_DELAY", "8.0"))  # Send a duplicate request after this long; 0 disables
+    CLAUDE_BATCH_POLL_SECONDS: float = 60.0  # Message Batches status polling (offline jobs)
+
+    # Micro-batching of concurrent generation requests
+    BATCH_MAX_SIZE: int = int(os.getenv("BATCH_MAX_SIZE", "8"))  # Output quality drops past ~16 per call
+    BATCH_MAX_WAIT_MS: int = int(os.getenv("BATCH_MAX_WAIT_MS", "25"))
+    BATCH_MAX_QUERIES: int = 60  # Total queries per Claude call (fits max_tokens)
+    GENERATION_CACHE_MAX: int = 1024  # In-process LRU of generated query lists
 
     # Geographic Settings
     GEOLOCATOR_USER_AGENT: str = "smart_query_builder_v1"
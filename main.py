@@ -1,28 +1,78 @@
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import TypeAdapter, ValidationError
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
+import asyncio
+import atexit
+import httpx
 import logging
+import orjson
+import queue
 import time
-import uuid
+import secrets
 
 # Import your services
-from services.claude_service import ClaudeService
+from services.claude_service import ClaudeService, close_client
 from services.Serp_service import SerpService  # If you have it
+from services.cache_service import ResponseCache
+from services.semantic_cache import SemanticCache
+from services.batcher import QueryBatcher
+from services.query_builder import request_filter
+from models import QueryRequest
+from config import settings
 
-# Setup logging
+# Setup logging: records are queued and written to stderr by a background
+# thread, so handlers never block the event loop on log I/O
+log_queue = queue.Queue(-1)
+log_listener = QueueListener(log_queue, logging.StreamHandler())
 logging.basicConfig(
     level=logging.INFO,
-    format='%(levelname)s:%(name)s:%(message)s'
+    format='%(levelname)s:%(name)s:%(message)s',
+    handlers=[QueueHandler(log_queue)]
 )
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Sized for the to_thread work (SERP disk cache, semantic cache encoding)
+    # rather than the CPU-count default, which caps concurrency under load
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=settings.THREAD_POOL_SIZE, thread_name_prefix="sqb-worker")
+    )
+    # The Redis client connects lazily - check it's really there
+    global CACHE_ENABLED
+    if response_cache:
+        CACHE_ENABLED = await response_cache.ping()
+        if CACHE_ENABLED:
+            logger.info("✅ Response cache enabled")
+        else:
+            logger.warning("⚠️  Response cache disabled: Redis is not reachable")
+    await query_batcher.start()
+    yield
+    await query_batcher.stop()
+    if serp_service:
+        await serp_service.aclose()
+    if response_cache:
+        await response_cache.close()
+    await close_client()
+    await http_client.aclose()
+
+
 # Create FastAPI app
 app = FastAPI(
     title="Smart Query Builder",
     description="Generate intelligent Google search queries for B2C lead generation",
-    version="2.0"
+    version="2.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # CORS
@@ -34,18 +84,60 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Request model
-class QueryRequest(BaseModel):
-    industry: str
-    region: str
-    top_k: int = 10
+# Built once - FastAPI would otherwise rebuild validation per call
+_REQ_ADAPTER = TypeAdapter(QueryRequest)
+
+
+async def parse_query_request(http_request: Request) -> QueryRequest:
+    """Validate the raw JSON body in one pass (no intermediate dict)"""
+    try:
+        return _REQ_ADAPTER.validate_json(await http_request.body())
+    except ValidationError as e:
+        raise RequestValidationError([
+            {**error, "loc": ("body", *error["loc"])}
+            for error in e.errors(include_url=False)
+        ])
+
+
+async def fetch_serp_context(request: QueryRequest, request_id: str):
+    """SERP hints for the prompt, or None if disabled, failing or too slow"""
+    if not (SERP_ENABLED and serp_service):
+        return None
+    try:
+        return await asyncio.wait_for(
+            serp_service.get_intelligent_context(request.industry, request.region),
+            settings.SERP_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        logger.warning(f"[{request_id}] SERP timed out after {settings.SERP_TIMEOUT}s, continuing without context")
+    except Exception as e:
+        logger.warning(f"[{request_id}] SERP fetch failed: {e}")
+    return None
+
+
+def sse_event(event: str, data) -> bytes:
+    """Encode one Server-Sent Events frame"""
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+# One pooled HTTP/2 client shared by Claude and SERP calls, so TCP+TLS
+# handshakes are paid once per connection instead of once per request
+http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(
+        max_connections=settings.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE
+    ),
+    timeout=settings.HTTP_TIMEOUT
+)
 
 # Initialize services
-claude_service = ClaudeService()
+claude_service = ClaudeService(http_client=http_client)
+query_batcher = QueryBatcher(claude_service)
+CLAUDE_MODEL_NAME = claude_service.fast_model  # First tier tried; meta reports the one that answered
 
 # Try to initialize SERP service if available
 try:
-    serp_service = SerpService()
+    serp_service = SerpService(http_client=http_client)
     SERP_ENABLED = True
     logger.info("✅ SERP service enabled")
 except Exception as e:
@@ -53,6 +145,49 @@ except Exception as e:
     SERP_ENABLED = False
     logger.warning(f"⚠️  SERP service disabled: {e}")
 
+# Exact-match response cache (Redis)
+try:
+    response_cache = ResponseCache()
+    CACHE_ENABLED = True  # Confirmed (or turned off) by the startup ping
+except Exception as e:
+    response_cache = None
+    CACHE_ENABLED = False
+    logger.warning(f"⚠️  Response cache disabled: {e}")
+
+# Near-duplicate cache (optional sentence-transformers + FAISS)
+try:
+    semantic_cache = SemanticCache()
+    SEMANTIC_CACHE_ENABLED = True
+    logger.info("✅ Semantic cache enabled")
+except Exception as e:
+    semantic_cache = None
+    SEMANTIC_CACHE_ENABLED = False
+    logger.warning(f"⚠️  Semantic cache disabled: {e}")
+
+# Response meta prototype - fixed fields set once, per-request ones overwritten
+_META_PROTO = {
+    "industry": "",
+    "region": "",
+    "execution_time": 0.0,
+    "query_count": 0,
+    "requested_count": 0,
+    "serp_enabled": SERP_ENABLED,
+    "model_used": "",
+    "timestamp": 0
+}
+
+
+def build_meta(request: QueryRequest, query_count: int, execution_time: float, model_used: str) -> dict:
+    meta = _META_PROTO.copy()
+    meta["industry"] = request.industry
+    meta["region"] = request.region
+    meta["execution_time"] = round(execution_time, 2)
+    meta["query_count"] = query_count
+    meta["requested_count"] = request.top_k
+    meta["model_used"] = model_used
+    meta["timestamp"] = int(time.time())
+    return meta
+
 
 @app.get("/")
 async def root():
@@ -63,8 +198,10 @@ async def root():
         "version": "2.0",
         "features": {
             "serp_intelligence": SERP_ENABLED,
+            "response_cache": CACHE_ENABLED,
+            "semantic_cache": SEMANTIC_CACHE_ENABLED,
             "b2c_focus": True,
-            "claude_model": claude_service.model
+            "claude_model": CLAUDE_MODEL_NAME
         }
     }
 
@@ -79,88 +216,275 @@ async def health():
     }
 
 
-@app.post("/queries/build")
-async def build_queries(request: QueryRequest):
+def fallback_top_up(request: QueryRequest, queries: list, apply_filters) -> list:
+    """Fallback queries that fill queries up to top_k, skipping ones already there"""
+    seen = {query.lower() for query in queries}
+    extra = []
+    for query in map(
+        apply_filters, claude_service._generate_fallback_queries(request.industry, request.region, request.top_k)
+    ):
+        if len(queries) + len(extra) >= request.top_k:
+            break
+        if query is not None and query.lower() not in seen:
+            seen.add(query.lower())
+            extra.append(query)
+    return extra
+
+
+def build_fallback_response(request: QueryRequest, request_id: str, start_ns: int, error: str) -> dict:
+    """
+    Answer a /queries/build whose generation failed with basic fallback
+    queries. Never cached - the next request tries Claude again.
+    """
+    logger.error(f"[{request_id}] Error: {error}")
+
+    # Return error with fallback
+    execution_time = (time.monotonic_ns() - start_ns) / 1e9
+    fallback_queries = fallback_top_up(request, [], request_filter(request))
+
+    return {
+        "queries": fallback_queries,
+        "meta": {
+            "error": error,
+            "fallback": True,
+            "industry": request.industry,
+            "region": request.region,
+            "execution_time": round(execution_time, 2),
+            "query_count": len(fallback_queries),
+            "requested_count": request.top_k,  # Templates can run out before a large top_k
+            "timestamp": int(time.time())
+        },
+        "request_id": request_id
+    }
+
+
+@app.post(
+    "/queries/build",
+    openapi_extra={"requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": QueryRequest.model_json_schema()}}
+    }}
+)
+async def build_queries(request: QueryRequest = Depends(parse_query_request)):
     """
     Generate intelligent B2C search queries
 
     CORRECT implementation showing how to call ClaudeService
     """
-    start_time = time.time()
-    request_id = str(uuid.uuid4())[:8]
+    start_ns = time.monotonic_ns()
+    request_id = secrets.token_hex(4)
+
+    # Step 0: Serve identical requests from cache
+    payload = request.model_dump()
+    cache_key = None
+    if CACHE_ENABLED:
+        cache_key = response_cache.make_key(payload)
+        cached = await response_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"[{request_id}] Cache hit")
+            # Cached bytes are already JSON - skip decode/re-encode
+            return Response(
+                content=response_cache.with_request_id(cached, request_id),
+                media_type="application/json"
+            )
 
-    logger.info(f"[{request_id}] Building queries: {request.industry} in {request.region}")
+    # Step 0b: Serve near-identical requests ("NYC" vs "New York City")
+    semantic_params = {k: v for k, v in payload.items() if k not in ("industry", "region")}
+    if SEMANTIC_CACHE_ENABLED:
+        cached = await semantic_cache.lookup(request.industry, request.region, semantic_params)
+        if cached is not None:
+            logger.info(f"[{request_id}] Semantic cache hit")
+            # The stored meta describes the other request - rebuild it for this one
+            queries = cached["queries"]
+            meta = build_meta(
+                request, len(queries), (time.monotonic_ns() - start_ns) / 1e9,
+                cached["meta"].get("model_used", CLAUDE_MODEL_NAME)
+            )
+            if cache_key:
+                await response_cache.set(cache_key, {"queries": queries, "meta": meta}, response_cache.ttl_for(payload))
+            return {"queries": queries, "meta": {**meta, "cache": "semantic"}, "request_id": request_id}
 
+    # Step 1: Get SERP context (optional but recommended)
+    serp_start_ns = time.monotonic_ns()
+    serp_context = await fetch_serp_context(request, request_id)
+    serp_time = (time.monotonic_ns() - serp_start_ns) / 1e9
+
+    # Step 2: Generate queries with Claude (concurrent requests are batched)
+    claude_start_ns = time.monotonic_ns()
     try:
-        # Step 1: Get SERP context (optional but recommended)
-        serp_context = None
-        if SERP_ENABLED and serp_service:
-            try:
-                logger.info(f"[{request_id}] Fetching SERP context...")
-                serp_context = await serp_service.get_intelligent_context(
-                    request.industry,
-                    request.region
-                )
-                logger.info(f"[{request_id}] SERP context fetched")
-            except Exception as e:
-                logger.warning(f"[{request_id}] SERP fetch failed: {e}")
-
-        # Step 2: Generate queries with Claude
-        # THIS IS THE CRITICAL PART - HOW TO CALL IT CORRECTLY
-        logger.info(f"[{request_id}] Calling Claude service...")
-
-        queries = claude_service.generate_intelligent_queries(
-            industry=request.industry,    # REQUIRED
-            region=request.region,        # REQUIRED
-            top_k=request.top_k,          # Optional, defaults to 10
-            serp_context=serp_context     # Optional
+        queries, model_used = await asyncio.wait_for(
+            query_batcher.submit(
+                industry=request.industry,
+                region=request.region,
+                top_k=request.top_k,
+                serp_context=serp_context
+            ),
+            settings.CLAUDE_TIMEOUT
         )
+    except asyncio.TimeoutError:
+        return build_fallback_response(
+            request, request_id, start_ns, f"Claude did not respond within {settings.CLAUDE_TIMEOUT}s"
+        )
+    except Exception as e:
+        return build_fallback_response(request, request_id, start_ns, str(e))
+    claude_time = (time.monotonic_ns() - claude_start_ns) / 1e9
 
-        logger.info(f"[{request_id}] Generated {len(queries)} queries")
-
-        # Step 3: Build response
-        execution_time = time.time() - start_time
-
-        response = {
-            "queries": queries,
-            "meta": {
-                "industry": request.industry,
-                "region": request.region,
-                "execution_time": round(execution_time, 2),
-                "query_count": len(queries),
-                "requested_count": request.top_k,
-                "serp_enabled": SERP_ENABLED,
-                "model_used": claude_service.model,
-                "timestamp": int(time.time())
-            },
-            "request_id": request_id
-        }
+    # Step 3: Apply includes/excludes/personal_only. Batched results are
+    # shared across requests, so filter here rather than in the batcher
+    apply_filters = request_filter(request)
+    queries = [query for query in map(apply_filters, queries) if query is not None]
 
-        logger.info(f"[{request_id}] Success! Generated {len(queries)} queries in {execution_time:.2f}s")
-        return response
+    # Short results are topped up with fallback queries, same as the stream
+    fallback = len(queries) < request.top_k
+    if fallback:
+        logger.warning(f"[{request_id}] Claude returned {len(queries)}/{request.top_k} queries, topping up with fallback")
+        queries += fallback_top_up(request, queries, apply_filters)
 
-    except Exception as e:
-        logger.error(f"[{request_id}] Error: {str(e)}", exc_info=True)
-
-        # Return error with fallback
-        execution_time = time.time() - start_time
-
-        return {
-            "queries": [],
-            "meta": {
-                "error": str(e),
-                "fallback": True,
-                "industry": request.industry,
-                "region": request.region,
-                "execution_time": round(execution_time, 2),
-                "query_count": 0,
-                "timestamp": int(time.time())
-            },
-            "request_id": request_id
-        }
+    # Step 4: Build response
+    execution_time = (time.monotonic_ns() - start_ns) / 1e9
+
+    response = {
+        "queries": queries,
+        "meta": build_meta(request, len(queries), execution_time, model_used),
+        "request_id": request_id
+    }
+    if fallback:
+        response["meta"]["fallback"] = True
+
+    # Only full model output is stored - Claude failures and timeouts get the
+    # uncached fallback response above, and topped-up results aren't kept
+    cacheable = {"queries": response["queries"], "meta": response["meta"]}
+    if not fallback:
+        if cache_key:
+            await response_cache.set(cache_key, cacheable, response_cache.ttl_for(payload))
+        if SEMANTIC_CACHE_ENABLED:
+            await semantic_cache.add(request.industry, request.region, semantic_params, cacheable)
 
+    logger.info(
+        f"[{request_id}] Built {len(queries)}/{request.top_k} queries for "
+        f"'{request.industry}' in '{request.region}' "
+        f"(serp={serp_time:.2f}s claude={claude_time:.2f}s total={execution_time:.2f}s)"
+    )
+    return response
 
-# Run with: uvicorn main:app --host 0.0.0.0 --port 8000
+
+@app.post(
+    "/queries/build/stream",
+    openapi_extra={"requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": QueryRequest.model_json_schema()}}
+    }}
+)
+async def build_queries_stream(request: QueryRequest = Depends(parse_query_request)):
+    """
+    Same as /queries/build, but sends each query as an SSE `query` event as
+    soon as Claude writes it. The meta block arrives in a final `end` event.
+    """
+    start_ns = time.monotonic_ns()
+    request_id = secrets.token_hex(4)
+
+    async def events():
+        yield sse_event("start", {"request_id": request_id})
+
+        payload = request.model_dump()
+        cache_key = None
+        if CACHE_ENABLED:
+            cache_key = response_cache.make_key(payload)
+            cached = await response_cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"[{request_id}] Cache hit (stream)")
+                cached = orjson.loads(cached)
+                for query in cached["queries"]:
+                    yield sse_event("query", query)
+                yield sse_event("end", {"meta": cached["meta"], "request_id": request_id})
+                return
+
+        # Near-identical requests, same as /queries/build
+        semantic_params = {k: v for k, v in payload.items() if k not in ("industry", "region")}
+        if SEMANTIC_CACHE_ENABLED:
+            cached = await semantic_cache.lookup(request.industry, request.region, semantic_params)
+            if cached is not None:
+                logger.info(f"[{request_id}] Semantic cache hit (stream)")
+                for query in cached["queries"]:
+                    yield sse_event("query", query)
+                meta = build_meta(
+                    request, len(cached["queries"]), (time.monotonic_ns() - start_ns) / 1e9,
+                    cached["meta"].get("model_used", CLAUDE_MODEL_NAME)
+                )
+                yield sse_event("end", {"meta": {**meta, "cache": "semantic"}, "request_id": request_id})
+                return
+
+        serp_context = await fetch_serp_context(request, request_id)
+
+        apply_filters = request_filter(request)
+        queries = []
+        fallback = False
+        try:
+            async for query in claude_service.stream_queries(
+                industry=request.industry,
+                region=request.region,
+                top_k=request.top_k,
+                serp_context=serp_context,
+                allow_fallback=False
+            ):
+                query = apply_filters(query)
+                if query is not None:
+                    queries.append(query)
+                    yield sse_event("query", query)
+        except Exception as e:
+            logger.warning(f"[{request_id}] Claude stream failed after {len(queries)} queries: {e}")
+
+        # Top up failed or short streams with fallback queries, and don't
+        # cache the result
+        if len(queries) < request.top_k:
+            fallback = True
+            for query in fallback_top_up(request, queries, apply_filters):
+                queries.append(query)
+                yield sse_event("query", query)
+
+        execution_time = (time.monotonic_ns() - start_ns) / 1e9
+        # Streaming runs on the fast tier only
+        meta = build_meta(request, len(queries), execution_time, claude_service.fast_model)
+        if fallback:
+            meta["fallback"] = True
+        yield sse_event("end", {"meta": meta, "request_id": request_id})
+
+        if queries and not fallback:
+            if cache_key:
+                await response_cache.set(cache_key, {"queries": queries, "meta": meta}, response_cache.ttl_for(payload))
+            if SEMANTIC_CACHE_ENABLED:
+                await semantic_cache.add(request.industry, request.region, semantic_params, {"queries": queries, "meta": meta})
+
+        logger.info(
+            f"[{request_id}] Streamed {len(queries)}/{request.top_k} queries for "
+            f"'{request.industry}' in '{request.region}' (total={execution_time:.2f}s)"
+        )
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# Run with: uvicorn main:app --host 0.0.0.0 --port 8000 --loop uvloop --http httptools
 if __name__ == "__main__":
+    import os
+    import sys
+    import sysconfig
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+
+    # On a free-threaded build (3.13t, PYTHON_GIL=0) threads already run in
+    # parallel, so one process with to_thread work beats forking workers
+    free_threaded = bool(sysconfig.get_config_var("Py_GIL_DISABLED"))
+    default_workers = 1 if free_threaded else os.cpu_count() or 1
+
+    # uvloop has no Windows build - keep the default loop there
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", 8000)),
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        workers=int(os.environ.get("WEB_CONCURRENCY", default_workers))
+    )
\ No newline at end of file
@@ -1,20 +1,24 @@
 """
 Data models for Smart Query Builder
 """
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List, Optional, Dict, Any
 
 class QueryRequest(BaseModel):
     """What the user sends to our API"""
-    industry: str = Field(..., description="Industry like 'FinTech' or 'Healthcare'")
-    region: str = Field(..., description="Location like 'San Francisco' or 'New York'")
-    top_k: Optional[int] = Field(default=15, description="Number of queries to generate")
+    model_config = ConfigDict(extra='ignore', str_strip_whitespace=True, frozen=True)
+
+    industry: str = Field(..., min_length=1, max_length=100, description="Industry like 'FinTech' or 'Healthcare'")
+    region: str = Field(..., min_length=1, max_length=100, description="Location like 'San Francisco' or 'New York'")
+    top_k: int = Field(default=10, ge=1, le=100, description="Number of queries to generate")
     includes: Optional[List[str]] = Field(default=[], description="Must include these terms")
     excludes: Optional[List[str]] = Field(default=[], description="Must exclude these sites")
     personal_only: Optional[bool] = Field(default=False, description="Focus on personal emails")
 
 class QueryResponse(BaseModel):
     """What we send back to the user"""
+    model_config = ConfigDict(extra='ignore', frozen=True)
+
     queries: List[str] = Field(..., description="Generated search queries")
     meta: Dict[str, Any] = Field(..., description="Additional information")
     analytics: Dict[str, Any] = Field(..., description="Query statistics")
@@ -31,7 +35,10 @@ class IndustryAnalysis(BaseModel):
 
 class GeographicData(BaseModel):
     """Geographic information about the location"""
+    model_config = ConfigDict(frozen=True)  # Cached and shared across requests
+
     primary_city: str = Field(..., description="Main city name")
+    canonical_city: Optional[str] = Field(default=None, description="Known city the region resolved to")
     neighborhoods: List[str] = Field(default=[], description="Local areas")
     metro_areas: List[str] = Field(default=[], description="Metro areas")
     local_names: List[str] = Field(default=[], description="Alternative names")
@@ -1,17 +1,37 @@
 """
 SERP Service for intelligent keyword and location understanding
 """
-import os
+import asyncio
 import re
+import sys
+import time
 
 import httpx
 import logging
-import json
-from typing import Dict, List, Optional
-from datetime import datetime, timedelta
+import orjson
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from config import settings
 
 logger = logging.getLogger(__name__)
 
+CacheKey = Tuple[str, str]  # (keyword, location), lowercased
+
+_DESCRIPTORS = frozenset({
+    'agency', 'firm', 'company', 'contractor', 'studio', 'consultancy', 'partners', 'group',
+    'services', 'solutions', 'center', 'clinic', 'shop', 'store', 'restaurant', 'cafe'
+})
+_STOPWORDS = frozenset({'the', 'and', 'for'})
+
+# Business descriptors as whole whitespace-separated words - one C-level
+# scan per result
+_DESCRIPTOR_RE = re.compile(r'(?<!\S)(' + '|'.join(sorted(_DESCRIPTORS)) + r')(?!\S)')
+_REAL_ESTATE_RE = re.compile(r'realty|property|realtor')
+
+# Any of these in the top snippets marks a B2B category
+_B2B_RE = re.compile(r'wholesale|supplier|manufacturer|distributor|b2b|enterprise|solutions|consulting')
+
 
 class SerpService:
     """
@@ -20,11 +40,26 @@ class SerpService:
     2. Geographic intelligence about the location
     """
 
-    def __init__(self):
-        self.api_key = os.getenv('SERP_API_KEY')
+    def __init__(self, http_client: Optional[httpx.AsyncClient] = None):
+        self.api_key = settings.SERP_API_KEY
+        # Shared pooled client if provided, otherwise one of our own so
+        # connections (and TLS sessions) are reused across calls
+        self._owns_client = http_client is None
+        self.http_client = http_client or httpx.AsyncClient(
+            http2=True,
+            timeout=10.0,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=50)
+        )
         self.base_url = "https://serpapi.com/search.json"  # SerpAPI endpoint
-        self.cache = {}
+        # LRU of cache_key -> (context, expires_at on the monotonic clock)
+        self.cache: "OrderedDict[CacheKey, Tuple[Dict, float]]" = OrderedDict()
+        self.cache_max = 4096
         self.cache_ttl = 86400  # 24 hours cache for keyword insights
+        self.cache_error_ttl = 300  # Failed lookups retry after 5 minutes
+        # cache_key -> SERP fetch already running, shared by concurrent callers
+        self._inflight: Dict[CacheKey, asyncio.Task] = {}
+        # Disk layer under the LRU: cache_key -> (context, stored_at wall time)
+        self.disk_cache = self._open_disk_cache()
 
         if not self.api_key:
             logger.warning("SERP_API_KEY not found in environment variables")
@@ -35,27 +70,110 @@ class SerpService:
         Returns enriched context for query generation
         """
 
-        # Check cache first
-        cache_key = f"{keyword.lower()}_{location.lower()}"
-        if cache_key in self.cache:
-            cached_data, timestamp = self.cache[cache_key]
-            if datetime.now() - timestamp < timedelta(seconds=self.cache_ttl):
+        # Check cache first (interned parts: equal keys share one string object)
+        cache_key = (sys.intern(keyword.lower()), sys.intern(location.lower()))
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            cached_data, expires_at = cached
+            if time.monotonic() < expires_at:
+                self.cache.move_to_end(cache_key)
                 logger.info(f"Using cached context for {keyword} in {location}")
                 return cached_data
+            del self.cache[cache_key]
+
+        # Then disk, which other workers and earlier runs may have filled
+        stored = await self._disk_get(cache_key)
+        if stored is not None:
+            cached_data, stored_at = stored
+            age = time.time() - stored_at
+            if age < self.cache_ttl:
+                self._cache_put(cache_key, cached_data, self.cache_ttl - age)
+                logger.info(f"Using disk-cached context for {keyword} in {location}")
+                return cached_data
 
+            # Stale (disk entries expire at 2x TTL): answer now, refresh in the background
+            if cache_key not in self._inflight:
+                self._start_load(cache_key, keyword, location, stale=cached_data)
+            logger.info(f"Using stale context for {keyword} in {location} while refreshing")
+            return cached_data
+
+        # Join an identical fetch that's already running instead of starting
+        # another; shield it so one caller timing out doesn't cancel the rest
+        task = self._inflight.get(cache_key) or self._start_load(cache_key, keyword, location)
+        return await asyncio.shield(task)
+
+    def _start_load(self, cache_key: CacheKey, keyword: str, location: str,
+                    stale: Optional[Dict] = None) -> asyncio.Task:
+        task = asyncio.ensure_future(self._load_context(cache_key, keyword, location, stale))
+        self._inflight[cache_key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(cache_key, None))
+        return task
+
+    async def _load_context(self, cache_key: CacheKey, keyword: str, location: str,
+                            stale: Optional[Dict] = None) -> Dict:
+        """
+        Fetch context from SERP and cache it. On failure keep serving the
+        stale context being refreshed, if any, else the fallback - briefly.
+        """
         try:
             # Make ONE intelligent SERP call that gives us both business types AND location context
             context = await self._fetch_intelligent_context(keyword, location)
 
             # Cache the result
-            self.cache[cache_key] = (context, datetime.now())
+            self._cache_put(cache_key, context, self.cache_ttl)
+            await self._disk_set(cache_key, context)
 
             return context
 
         except Exception as e:
             logger.error(f"SERP API error: {e}")
-            # Return intelligent fallback without SERP
-            return self._get_fallback_context(keyword, location)
+            # Return the stale context (real SERP data beats the generic
+            # fallback) or intelligent fallback without SERP, and remember it
+            # briefly so a failing API isn't hit again by every request
+            context = stale if stale is not None else self._get_fallback_context(keyword, location)
+            self._cache_put(cache_key, context, self.cache_error_ttl)
+            return context
+
+    async def aclose(self):
+        """Close the HTTP client if this service created it, and the disk cache"""
+        if self._owns_client:
+            await self.http_client.aclose()
+        if self.disk_cache is not None:
+            self.disk_cache.close()
+
+    def _open_disk_cache(self):
+        try:
+            import diskcache
+            return diskcache.Cache(settings.SERP_DISK_CACHE_DIR, size_limit=settings.SERP_DISK_CACHE_SIZE)
+        except Exception as e:
+            logger.warning(f"SERP disk cache disabled: {e}")
+            return None
+
+    async def _disk_get(self, cache_key: CacheKey) -> Optional[Tuple[Dict, float]]:
+        if self.disk_cache is None:
+            return None
+        try:
+            return await asyncio.to_thread(self.disk_cache.get, cache_key)
+        except Exception as e:
+            logger.warning(f"SERP disk cache read failed: {e}")
+            return None
+
+    async def _disk_set(self, cache_key: CacheKey, context: Dict):
+        # Failed lookups stay memory-only; only real SERP context is persisted
+        if self.disk_cache is None:
+            return
+        try:
+            await asyncio.to_thread(
+                self.disk_cache.set, cache_key, (context, time.time()), expire=2 * self.cache_ttl
+            )
+        except Exception as e:
+            logger.warning(f"SERP disk cache write failed: {e}")
+
+    def _cache_put(self, cache_key: CacheKey, context: Dict, ttl: float):
+        self.cache[cache_key] = (context, time.monotonic() + ttl)
+        self.cache.move_to_end(cache_key)
+        if len(self.cache) > self.cache_max:
+            self.cache.popitem(last=False)
 
     async def _fetch_intelligent_context(self, keyword: str, location: str) -> Dict:
         """
@@ -65,22 +183,20 @@ class SerpService:
         # Smart query that reveals both business types AND geographic coverage
         search_query = f"{keyword} companies businesses {location}"
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                self.base_url,
-                params={
-                    "api_key": self.api_key,
-                    "q": search_query,
-                    "location": location,
-                    "num": "10",  # Just 10 results is enough
-                    "gl": "us"  # or detect from location
-                }
-            )
+        params = {
+            "api_key": self.api_key,
+            "q": search_query,
+            "location": location,
+            "num": "10",  # Just 10 results is enough
+            "gl": "us"  # or detect from location
+        }
+
+        response = await self.http_client.get(self.base_url, params=params)
 
-            if response.status_code != 200:
-                raise Exception(f"SERP API returned {response.status_code}")
+        if response.status_code != 200:
+            raise Exception(f"SERP API returned {response.status_code}")
 
-            data = response.json()
+        data = orjson.loads(response.content)
 
         # Extract intelligence from SERP results
         return self._extract_intelligence(data, keyword, location)
@@ -93,85 +209,76 @@ class SerpService:
         # Parse organic results
         organic_results = serp_data.get('organic_results', [])
         local_results = serp_data.get('local_results', {}).get('places', [])
-        related_searches = serp_data.get('related_searches', [])
 
-        # Extract business types that actually show up
-        business_types = set()
-        business_terms = set()
-        location_variants = set()
+        # Extract business types that actually show up - dicts keep first-seen
+        # order, so the same SERP data always yields the same context
+        max_types, max_terms, max_areas = 5, 5, 8
+        business_types: Dict[str, None] = {}
+        # The original keyword always leads the variations
+        business_terms: Dict[str, None] = {keyword: None}
+        location_variants: Dict[str, None] = {}
+
+        keyword_lower = keyword.lower()
+        location_lower = location.lower()
+        # The word right before any word containing the keyword (multi-word
+        # keywords match as a phrase)
+        prev_word_re = re.compile(r'(?<!\S)(\S+)\s+(?=\S*' + re.escape(keyword_lower) + ')')
 
         for result in organic_results[:10]:
+            if len(business_types) >= max_types and len(business_terms) >= max_terms:
+                break  # Enough signal - skip the remaining results
+
             title = result.get('title', '').lower()
             snippet = result.get('snippet', '').lower()
 
             # Extract business descriptors (agency, firm, company, contractor, etc.)
-            if keyword.lower() in title or keyword.lower() in snippet:
+            if keyword_lower in title or keyword_lower in snippet:
                 # This is a PRIMARY business, not a service provider
-                words = (title + ' ' + snippet).split()
-                for word in words:
-                    if word in ['agency', 'firm', 'company', 'contractor', 'studio',
-                                'consultancy', 'partners', 'group', 'services', 'solutions',
-                                'center', 'clinic', 'shop', 'store', 'restaurant', 'cafe']:
-                        business_types.add(word)
+                text = title + ' ' + snippet
+                business_types.update(dict.fromkeys(_DESCRIPTOR_RE.findall(text)))
 
                 # Extract variations of the keyword
                 # Look for related terms that appear with the keyword
-                if keyword.lower() == 'real estate':
-                    if 'realty' in title + snippet:
-                        business_terms.add('realty')
-                    if 'property' in title + snippet:
-                        business_terms.add('property')
-                    if 'realtor' in title + snippet:
-                        business_terms.add('realtor')
+                if keyword_lower == 'real estate':
+                    business_terms.update(dict.fromkeys(_REAL_ESTATE_RE.findall(text)))
                 # For any keyword, find variations
                 else:
                     # Extract words that appear near the keyword
-                    text = title + ' ' + snippet
-                    words = text.split()
-                    keyword_pos = [i for i, w in enumerate(words) if keyword.lower() in w.lower()]
-                    for pos in keyword_pos:
-                        # Get surrounding words that might be variations
-                        if pos > 0:
-                            prev_word = words[pos - 1]
-                            if len(prev_word) > 3 and prev_word not in ['the', 'and', 'for']:
-                                business_terms.add(prev_word)
+                    for prev_word in prev_word_re.findall(text):
+                        if len(prev_word) > 3 and prev_word not in _STOPWORDS:
+                            business_terms[prev_word] = None
 
         # Extract location intelligence from local results
         for place in local_results:
+            if len(location_variants) >= max_areas:
+                break
             address = place.get('address', '')
             # Parse neighborhoods and areas from addresses
             if ',' in address:
                 parts = address.split(',')
                 if len(parts) > 1:
                     area = parts[-2].strip()  # Usually neighborhood or district
-                    if area and area.lower() != location.lower():
-                        location_variants.add(area)
-
-        # Get related search terms for more variations
-        keyword_variations = set()
-        for related in related_searches:
-            query = related.get('query', '').lower()
-            if keyword.lower() in query:
-                # Extract the variation
-                variation = query.replace(keyword.lower(), '').strip()
-                if variation and len(variation) > 2:
-                    keyword_variations.add(variation)
-
-        # Add the original keyword to variations
-        business_terms.add(keyword)
+                    if area and area.lower() != location_lower:
+                        location_variants[area] = None
 
         # Build intelligent context
         context = {
-            "primary_business_types": list(business_types)[:5] if business_types else ["company", "business",
-                                                                                       "services"],
-            "keyword_variations": list(business_terms)[:5] if business_terms else [keyword],
-            "location_areas": list(location_variants)[:8] if location_variants else [location],
+            "primary_business_types": list(business_types)[:max_types] if business_types else ["company", "business",
+                                                                                               "services"],
+            "keyword_variations": list(business_terms)[:max_terms],
+            "location_areas": list(location_variants)[:max_areas] if location_variants else [location],
             "search_patterns": self._identify_patterns(organic_results),
             "is_b2b": self._is_b2b_category(keyword, organic_results),
             "suggested_email_domains": self._suggest_email_domains(keyword)
         }
 
-        logger.info(f"Extracted context for {keyword} in {location}: {json.dumps(context, indent=2)}")
+        logger.info(
+            f"Extracted context for {keyword} in {location}: "
+            f"{len(context['primary_business_types'])} business types, {len(context['location_areas'])} areas"
+        )
+        # Serializing the whole context is only worth it when someone reads it
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Context: {orjson.dumps(context, option=orjson.OPT_INDENT_2).decode()}")
 
         return context
 
@@ -195,18 +302,15 @@ class SerpService:
             elif 'about' in url or 'contact' in url:
                 patterns.append('company_page')
 
-        return list(set(patterns))[:3] if patterns else ['company_page']
+        return list(dict.fromkeys(patterns))[:3] if patterns else ['company_page']
 
     def _is_b2b_category(self, keyword: str, results: List[Dict]) -> bool:
         """
         Determine if this is primarily a B2B category
         """
-        b2b_indicators = ['wholesale', 'supplier', 'manufacturer', 'distributor',
-                          'b2b', 'enterprise', 'solutions', 'consulting']
-
         text = ' '.join([r.get('snippet', '').lower() for r in results[:5]])
 
-        return any(indicator in text for indicator in b2b_indicators)
+        return _B2B_RE.search(text) is not None
 
     def _suggest_email_domains(self, keyword: str) -> List[str]:
         """
@@ -218,31 +322,6 @@ class SerpService:
         else:
             return ['@gmail.com', '@yahoo.com', '@outlook.com', '@hotmail.com', '@aol.com']
 
-    def _clean_serp_context(self, raw_context: dict) -> dict:
-        """Filter out garbage from SERP results"""
-
-        business_types = raw_context.get('primary_business_types', [])
-
-        # Filter out garbage
-        garbage_patterns = [
-            r'^\d+$',  # Just numbers like "4"
-            r'^company_page$',  # Metadata
-            r'^@\w+\.com$',  # Email domains
-            r'^[A-Z]{2,}$',  # Acronyms without context
-        ]
-
-        cleaned_types = []
-        for btype in business_types:
-            is_garbage = any(re.match(pattern, btype) for pattern in garbage_patterns)
-            if not is_garbage and len(btype) > 3:  # Minimum length
-                cleaned_types.append(btype)
-
-        return {
-            'business_types': cleaned_types[:5],  # Top 5 only
-            'is_b2b': raw_context.get('is_b2b', True),
-            'suggested_domains': ['@gmail.com', '@yahoo.com', '@outlook.com']
-        }
-
     def _get_fallback_context(self, keyword: str, location: str) -> Dict:
         """
         Intelligent fallback when SERP is unavailable
@@ -3,7 +3,16 @@
 Services package for Smart Query Builder
 """
 
-from .Serp_service import SerpService
-from .claude_service import ClaudeService
+__all__ = ['SerpService', 'ClaudeService']
 
-__all__ = ['SerpService', 'ClaudeService']
\ No newline at end of file
+
+def __getattr__(name):
+    # Import lazily, so importing one service doesn't pull in the other's
+    # dependencies (PEP 562)
+    if name == "SerpService":
+        from .Serp_service import SerpService
+        return SerpService
+    if name == "ClaudeService":
+        from .claude_service import ClaudeService
+        return ClaudeService
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
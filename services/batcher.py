@@ -0,0 +1,222 @@
+"""
+Micro-batcher that coalesces concurrent query generation requests
+"""
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import orjson
+
+from config import settings
+from services.claude_service import ClaudeService
+
+logger = logging.getLogger(__name__)
+
+# Past this many requests per prompt the model starts mixing them up
+MAX_BATCH_CEILING = 16
+
+ResultKey = Tuple[str, str, int, str]  # (industry, region, top_k, SERP fingerprint), lowercased
+Generated = Tuple[List[str], str]  # (queries, model that wrote them)
+
+
+def _serp_fingerprint(serp_context: Optional[Dict[str, Any]]) -> str:
+    """Short digest of the SERP hints, so requests with different hints never share a result"""
+    if not serp_context:
+        return ""
+    return hashlib.blake2b(
+        orjson.dumps(serp_context, option=orjson.OPT_SORT_KEYS, default=str),
+        digest_size=8
+    ).hexdigest()
+
+
+class QueryBatcher:
+    """
+    Collects generation requests that arrive within a short window and sends
+    them to Claude together. A lone request is sent through the normal
+    single-request path, so batching only kicks in under concurrent load.
+    Results are kept in a small LRU, and identical requests that arrive
+    while one is generating wait for it instead of calling Claude again.
+    """
+
+    def __init__(self, claude_service: ClaudeService):
+        self.claude_service = claude_service
+        self.max_batch = max(1, min(settings.BATCH_MAX_SIZE, MAX_BATCH_CEILING))
+        self.max_wait = settings.BATCH_MAX_WAIT_MS / 1000
+        self.max_queries = settings.BATCH_MAX_QUERIES
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._in_flight = set()
+        # In-process LRU of generated queries: key -> (queries, model, expires_at)
+        self._results: "OrderedDict[ResultKey, Tuple[List[str], str, float]]" = OrderedDict()
+        self.results_max = settings.GENERATION_CACHE_MAX
+        self.results_ttl = settings.CACHE_TTL
+        # key -> generation already running, shared by identical concurrent requests
+        self._pending: Dict[ResultKey, asyncio.Task] = {}
+
+    async def start(self):
+        """Start the background collector (call from app startup)"""
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop collecting and cancel running generations (call before closing the client)"""
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        tasks = [*self._in_flight, *self._pending.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def submit(
+        self,
+        industry: str,
+        region: str,
+        top_k: int = 10,
+        serp_context: Optional[Dict[str, Any]] = None
+    ) -> Generated:
+        """Queue a request and wait for its queries and the model that wrote them"""
+        item = {
+            "industry": industry,
+            "region": region,
+            "top_k": top_k,
+            "serp_context": serp_context
+        }
+
+        key = (industry.lower(), region.lower(), top_k, _serp_fingerprint(serp_context))
+        cached = self._results.get(key)
+        if cached is not None:
+            queries, model, expires_at = cached
+            if time.monotonic() < expires_at:
+                self._results.move_to_end(key)
+                return list(queries), model
+            del self._results[key]
+
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key, item))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        # Shielded so one caller timing out doesn't cancel it for the others
+        queries, model = await asyncio.shield(task)
+        return list(queries), model
+
+    async def _load(self, key: ResultKey, item: Dict[str, Any]) -> Generated:
+        # Not started (scripts, tests) - just call Claude directly
+        if self._worker is None:
+            queries, model = await self._generate_one(item)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            await self._queue.put((item, future))
+            queries, model = await future
+
+        # Only model output gets here - failures raise (see _generate_one),
+        # so a Claude outage never leaves fallback queries in the LRU. Short
+        # results are returned but not kept, so the next request tries again.
+        if len(queries) >= item["top_k"]:
+            self._results[key] = (queries, model, time.monotonic() + self.results_ttl)
+            self._results.move_to_end(key)
+            if len(self._results) > self.results_max:
+                self._results.popitem(last=False)
+        return queries, model
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Dispatch without blocking collection of the next batch
+            for group in self._group(batch):
+                task = asyncio.create_task(self._dispatch(group))
+                self._in_flight.add(task)
+                task.add_done_callback(self._in_flight.discard)
+
+    def _group(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]) -> List[list]:
+        """
+        Pack requests with similar top_k together, keeping each Claude call
+        under max_queries so the response fits in max_tokens
+        """
+        groups = []
+        current, current_queries = [], 0
+
+        for entry in sorted(batch, key=lambda e: e[0]["top_k"]):
+            top_k = entry[0]["top_k"]
+            if current and current_queries + top_k > self.max_queries:
+                groups.append(current)
+                current, current_queries = [], 0
+            current.append(entry)
+            current_queries += top_k
+
+        if current:
+            groups.append(current)
+        return groups
+
+    async def _dispatch(self, group: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        try:
+            results = await self._generate_group([item for item, _ in group])
+        except Exception as e:
+            for _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(group, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def _generate_group(self, items: List[Dict[str, Any]]) -> List[Union[Generated, BaseException]]:
+        """One (queries, model) per item, or the error for items whose retry failed"""
+        if len(items) == 1:
+            return [await self._generate_one(items[0])]
+
+        # Batched prompts run on the fast tier only
+        model = self.claude_service.fast_model
+        try:
+            results = [(queries, model) for queries in await self.claude_service.generate_queries_batch(items)]
+        except Exception as e:
+            logger.warning(f"Batched generation failed, retrying {len(items)} requests individually: {e}")
+            results = [([], model) for _ in items]
+
+        # Anything the batch didn't cover goes through the single-request path
+        retry = [i for i, (queries, _) in enumerate(results) if not queries]
+        if retry:
+            # A failed retry only fails its own request, not the whole group
+            retried = await asyncio.gather(
+                *(self._generate_one(items[i]) for i in retry),
+                return_exceptions=True
+            )
+            for i, result in zip(retry, retried):
+                results[i] = result
+
+        return results
+
+    async def _generate_one(self, item: Dict[str, Any]) -> Generated:
+        # Raises on failure, so callers see it and nothing degraded gets cached
+        return await self.claude_service.generate_queries_with_model(
+            industry=item["industry"],
+            region=item["region"],
+            top_k=item["top_k"],
+            serp_context=item["serp_context"]
+        )
@@ -0,0 +1,99 @@
+"""
+Response cache for Smart Query Builder
+"""
+import hashlib
+import logging
+import time
+from typing import Any, Dict, Optional
+
+import orjson
+import redis.asyncio as redis
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    Exact-match Redis cache for /queries/build responses.
+    Redis errors never fail a request - they are logged and treated as a miss,
+    and Redis is then left alone for REDIS_RETRY_SECONDS instead of being
+    probed (and timed out on) by every request.
+    """
+
+    def __init__(self):
+        self.client = redis.from_url(
+            f"redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}/{settings.REDIS_DB}",
+            socket_connect_timeout=settings.REDIS_TIMEOUT,
+            socket_timeout=settings.REDIS_TIMEOUT
+        )
+        self._retry_at = 0.0  # monotonic time before which Redis is skipped
+
+    @staticmethod
+    def make_key(payload: Dict[str, Any]) -> str:
+        """
+        Stable key for a request payload. Case, spacing and the order of
+        filter terms don't change the generated queries, so they don't
+        change the key either ("FinTech" and "fintech " share an entry).
+        """
+        normalized = dict(payload)
+        for field in ("industry", "region"):
+            normalized[field] = " ".join(normalized[field].lower().split())
+        for field in ("includes", "excludes"):
+            normalized[field] = sorted({term.lower() for term in normalized.get(field) or ()})
+
+        digest = hashlib.blake2b(
+            orjson.dumps(normalized, option=orjson.OPT_SORT_KEYS),
+            digest_size=16
+        ).hexdigest()
+        return f"sqb:{digest}"
+
+    @staticmethod
+    def ttl_for(payload: Dict[str, Any]) -> int:
+        """Filtered requests are more specific, so keep them for less time"""
+        if payload.get('includes') or payload.get('excludes'):
+            return settings.CACHE_TTL_FILTERED
+        return settings.CACHE_TTL
+
+    @staticmethod
+    def with_request_id(body: bytes, request_id: str) -> bytes:
+        """Append request_id to a cached JSON object without re-encoding it"""
+        return body[:-1] + b',"request_id":"' + request_id.encode() + b'"}'
+
+    async def ping(self) -> bool:
+        """
+        Check Redis is reachable (call from app startup) - the client
+        connects lazily, so building it proves nothing
+        """
+        try:
+            await self.client.ping()
+            return True
+        except Exception as e:
+            logger.warning(f"Redis unreachable at {settings.REDIS_HOST}:{settings.REDIS_PORT}: {e}")
+            return False
+
+    def _failed(self, action: str, e: Exception):
+        self._retry_at = time.monotonic() + settings.REDIS_RETRY_SECONDS
+        logger.warning(f"Cache {action} failed, skipping Redis for {settings.REDIS_RETRY_SECONDS:g}s: {e}")
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """Return the cached JSON body, already encoded"""
+        if time.monotonic() < self._retry_at:
+            return None
+        try:
+            return await self.client.get(key)
+        except Exception as e:
+            self._failed("read", e)
+            return None
+
+    async def set(self, key: str, value: Dict[str, Any], ttl: int):
+        if time.monotonic() < self._retry_at:
+            return
+        try:
+            await self.client.set(key, orjson.dumps(value), ex=ttl)
+        except Exception as e:
+            self._failed("write", e)
+
+    async def close(self):
+        await self.client.close()
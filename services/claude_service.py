@@ -3,106 +3,31 @@ Claude Service - Intelligent Query Generation
 Completely rewritten to handle any industry input with semantic understanding
 """
 
-import anthropic
-import json
+import httpx
+import orjson
 import logging
 import re
 import asyncio
-from typing import List, Dict, Any, Optional
+import threading
+import weakref
+import zlib
+from functools import lru_cache
+from itertools import cycle, islice, product
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable, List, Dict, Any, Optional, Set, Tuple
 import os
 
+from config import settings
+from models import GeographicData, IndustryAnalysis, QueryRequest
 
-class ClaudeService:
-    """Service for generating intelligent search queries using Claude AI"""
-
-    def __init__(self):
-        self.client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-        # Use correct model name - claude-sonnet-4-5 is the latest (Sep 2025)
-        # Alternative: claude-sonnet-4 (May 2025) or claude-3-5-sonnet-20241022 (Oct 2024)
-        self.model = os.getenv("CLAUDE_MODEL", "claude-sonnet-4")
-        self.logger = logging.getLogger(__name__)
-
-    async def generate_queries(
-        self,
-        industry: str,
-        region: str,
-        top_k: int = 10,
-        serp_context: Optional[Dict[str, Any]] = None
-    ) -> List[str]:
-        """
-        Generate intelligent search queries with full semantic understanding.
-
-        Args:
-            industry: Any business type/industry (can be short or long phrase)
-            region: Geographic location
-            top_k: Number of queries to generate
-            serp_context: Optional context from SERP (used as hints, not rules)
-
-        Returns:
-            List of diverse, intelligent search queries
-        """
-        try:
-            self.logger.info(f"Generating {top_k} queries for '{industry}' in '{region}'")
-
-            # Build the intelligent prompt
-            prompt = self._build_intelligent_prompt(industry, region, top_k, serp_context)
+if TYPE_CHECKING:
+    import anthropic
 
-            # Call Claude
-            message = self.client.messages.create(
-                model=self.model,
-                max_tokens=4096,
-                temperature=0.7,  # Higher temperature for more creative variations
-                messages=[{
-                    "role": "user",
-                    "content": prompt
-                }]
-            )
 
-            # Extract and parse response
-            response_text = message.content[0].text.strip()
-            queries = self._parse_claude_response(response_text, top_k)
-
-            # Validate queries
-            validated_queries = self._validate_queries(queries, top_k)
-
-            self.logger.info(f"Successfully generated {len(validated_queries)} queries")
-            return validated_queries
-
-        except Exception as e:
-            self.logger.error(f"Error generating queries: {str(e)}")
-            # Fallback to basic queries if Claude fails
-            return self._generate_fallback_queries(industry, region, top_k)
-
-    def _build_intelligent_prompt(
-        self,
-        industry: str,
-        region: str,
-        top_k: int,
-        serp_context: Optional[Dict[str, Any]]
-    ) -> str:
-        """Build an intelligent prompt that handles any input type"""
-
-        # Clean SERP context if provided
-        context_hint = ""
-        if serp_context:
-            cleaned_context = self._clean_serp_context(serp_context)
-            if cleaned_context.get('business_types'):
-                context_hint = f"\n\nHINT from market research (use intelligently, ignore if irrelevant):\n- Related business types found: {', '.join(cleaned_context['business_types'][:5])}"
-
-        prompt = f"""You are an expert at generating Google X-ray search queries for lead generation. Your goal is to find business contacts across various platforms.
-
-INPUT:
-- Industry/Business Type: "{industry}"
-- Geographic Region: "{region}"
-- Number of queries needed: {top_k}
-
-YOUR TASK:
-Generate {top_k} highly diverse and intelligent Google search queries to find contacts in this industry.
-
-CRITICAL RULES FOR UNDERSTANDING THE INDUSTRY:
+# Static query-writing rules and examples shared by every prompt
+_QUERY_RULES = """CRITICAL RULES FOR UNDERSTANDING THE INDUSTRY:
 
 1. **Semantic Intelligence** (MOST IMPORTANT):
-   - Understand what "{industry}" actually means
+   - Understand what the requested industry actually means
    - If it's a long phrase like "real estate brokerage firms", understand the core business (real estate companies)
    - If it's "Insurance broker agents and agencies", understand it means BOTH professionals AND companies
    - If it's generic like "Insurance", expand to specific types (health insurance, auto insurance, life insurance)
@@ -144,14 +69,14 @@ CRITICAL RULES FOR UNDERSTANDING THE INDUSTRY:
    Each query should surprise - vary the domain (.com/.org/.net), location, business type, email domain, and pattern style.
 
 4. **Geographic Intelligence**:
-   - If "{region}" is a CITY (like "New York", "Chicago", "Los Angeles"):
+   - If the region is a CITY (like "New York", "Chicago", "Los Angeles"):
      * Include main city name
      * Include major neighborhoods/boroughs
      * Include metro area variations
-   - If "{region}" is a STATE (like "California", "Texas"):
+   - If the region is a STATE (like "California", "Texas"):
      * Include major cities in that state
      * Include state name and abbreviation
-   - If "{region}" is SMALL/UNKNOWN:
+   - If the region is SMALL/UNKNOWN:
      * Use the exact region name provided
      * Don't make up locations
 
@@ -259,7 +184,669 @@ GOOD - Randomized:
 ✅ site:.com "Espresso Bar" "Southeast Portland" "@hotmail.com"
 ✅ "Specialty Coffee" "Oregon" email -indeed
 ✅ site:.org "Coffee Shop" "Portland" "@yahoo.com"
-✅ "Craft Coffee Roaster" "Downtown PDX" contact -jobs
+✅ "Craft Coffee Roaster" "Downtown PDX" contact -jobs"""
+
+# Everything invariant goes in the system block, marked cacheable, so repeat
+# calls reuse the encoded prefix (cheaper input tokens, faster first token)
+_SYSTEM_BLOCKS = [{
+    "type": "text",
+    "text": "You are an expert at generating Google X-ray search queries for lead generation. "
+            "Your goal is to find business contacts across various platforms.\n\n" + _QUERY_RULES,
+    "cache_control": {"type": "ephemeral"}
+}]
+
+# SERP business types that are noise: bare numbers, metadata, email
+# domains, acronyms, URLs, punctuation. The acronym branch stays
+# case-sensitive, otherwise every plain word ("clinic") would match it.
+_SERP_GARBAGE_RE = re.compile(
+    r'^(?:\d+$|company_page$|@[\w\.-]+$|(?-i:[A-Z]{2,})$|(?:www|http|https)|\W+$)',
+    re.IGNORECASE
+)
+
+# The JSON array in a response, from the first "[" that opens a list of
+# strings/lists to the last "]" - skips code fences and stray prose brackets
+_JSON_ARRAY_RE = re.compile(r'\[\s*["\[].*\]', re.DOTALL)
+
+# Template leftovers that mark a query as unusable - one scan per query
+_QUERY_GARBAGE_RE = re.compile(r'undefined|null|example|placeholder')
+
+# The JSON object in an industry analysis response
+_JSON_OBJECT_RE = re.compile(r'\{.*\}', re.DOTALL)
+
+# A complete JSON string literal (escaped quotes included)
+_JSON_STRING_RE = re.compile(r'"(?:[^"\\]|\\.)*"')
+
+
+# Fallback query ingredients, built once at import rather than per call
+_FALLBACK_EMAIL_DOMAINS = ("@gmail.com", "@yahoo.com", "@outlook.com", "@hotmail.com", "@aol.com")
+_FALLBACK_TLDS = (".com", ".org", ".net")
+
+_ANALYSIS_SYSTEM = (
+    "You analyze industries for B2C lead generation: what the businesses are called, "
+    "who runs them and what related businesses exist."
+)
+
+# "Insurance Brokers" -> "Insurance Agency", "Insurance Services", ...
+_BROKERS_RE = re.compile(r'brokers', re.IGNORECASE)
+_BROKER_SUFFIXES = ("Agency", "Services", "Company", "Firm")
+
+# f-string lambdas: no template parsing per query, unlike str.format
+_FALLBACK_PATTERNS = (
+    lambda industry, location, email, domain: f'site:{domain} "{industry}" "{location}" "{email}"',
+    lambda industry, location, email, domain: f'site:{domain} "{industry}" "{location}" contact',
+    lambda industry, location, email, domain: f'"{industry}" "{location}" "{email}" -linkedin -jobs',
+    lambda industry, location, email, domain: f'site:{domain} "{industry}" "{location}" email',
+    lambda industry, location, email, domain: f'"{industry}" "{location}" "{email}" -indeed -careers',
+)
+
+
+def _rotated(values: tuple, offset: int) -> tuple:
+    """values starting at offset (mod len), wrapping around"""
+    offset %= len(values)
+    return values[offset:] + values[:offset]
+
+
+def _extract_json_array(text: str) -> str:
+    """The JSON array inside a response, or the whole text if none is found"""
+    # Usual case: the response is just the array - no regex scan needed
+    stripped = text.strip()
+    if stripped.startswith(('["', '[[')) and stripped.endswith(']'):
+        return stripped
+    match = _JSON_ARRAY_RE.search(text)
+    return match.group(0) if match else text
+
+
+def _max_tokens_for(query_count: int) -> int:
+    """Output budget for a JSON array of query_count queries - a tight cap
+    keeps the model from rambling past the array"""
+    return min(settings.CLAUDE_MAX_TOKENS, 64 + settings.CLAUDE_TOKENS_PER_QUERY * query_count)
+
+
+# Caps in-flight Claude calls so bursts queue here instead of tripping the
+# rate limit. One per event loop - a semaphore is bound to the loop it's
+# first used on, and each uvicorn worker (or asyncio.run) has its own.
+_SEMAPHORES: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def _claude_slot() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphore = _SEMAPHORES.get(loop)
+    if semaphore is None:
+        semaphore = _SEMAPHORES[loop] = asyncio.Semaphore(settings.CLAUDE_MAX_CONCURRENCY)
+    return semaphore
+
+
+# Sync callers reuse one event loop per thread instead of building and
+# tearing one down on every call
+_THREAD_LOCAL = threading.local()
+
+
+def _thread_loop() -> asyncio.AbstractEventLoop:
+    loop = getattr(_THREAD_LOCAL, "loop", None)
+    if loop is None or loop.is_closed():
+        loop = _THREAD_LOCAL.loop = asyncio.new_event_loop()
+    return loop
+
+
+@lru_cache(maxsize=512)
+def _clean_business_types(business_types: Tuple[str, ...]) -> Tuple[str, ...]:
+    """Drop garbage SERP business types, keeping the top 10"""
+    cleaned_types = []
+    for btype in business_types:
+        if not btype or len(btype) < 3:
+            continue
+
+        if not _SERP_GARBAGE_RE.match(str(btype)):
+            cleaned_types.append(btype)
+            if len(cleaned_types) >= 10:
+                break
+
+    return tuple(cleaned_types)
+
+
+@lru_cache(maxsize=512)
+def _role_titles(industry: str) -> Tuple[str, ...]:
+    return (
+        f"{industry} Owner",
+        f"{industry} Manager",
+        f"{industry} Director",
+        "Founder",
+        "Principal",
+    )
+
+
+# Anthropic clients per event loop and http_client, so every ClaudeService on
+# a loop shares one pool. Like _SEMAPHORES, keyed per loop - httpx connections
+# belong to the loop that opened them. Values are (client, owns_http_client).
+_CLIENTS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Optional[httpx.AsyncClient], Tuple[anthropic.AsyncAnthropic, bool]]]" = weakref.WeakKeyDictionary()
+
+
+def get_client(http_client: Optional[httpx.AsyncClient] = None) -> "anthropic.AsyncAnthropic":
+    """
+    Anthropic client for the running loop (or, outside one, this thread's
+    sync loop) and http_client, built on first use - the SDK import is slow
+    at cold start. Without an http_client (scripts, tests, sync callers) it
+    gets its own pooled HTTP/2 client rather than the SDK's HTTP/1.1 default.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = _thread_loop()
+    clients = _CLIENTS.get(loop)
+    if clients is None:
+        clients = _CLIENTS[loop] = {}
+
+    entry = clients.get(http_client)
+    if entry is None:
+        import anthropic
+        client = anthropic.AsyncAnthropic(
+            api_key=os.getenv("ANTHROPIC_API_KEY"),
+            max_retries=settings.CLAUDE_MAX_RETRIES,
+            timeout=settings.CLAUDE_REQUEST_TIMEOUT,
+            http_client=http_client or httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(
+                    max_connections=settings.HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE
+                ),
+                timeout=settings.CLAUDE_REQUEST_TIMEOUT
+            )
+        )
+        entry = clients[http_client] = (client, http_client is None)
+    return entry[0]
+
+
+async def close_client():
+    """
+    Close the running loop's clients (call from app shutdown). An
+    http_client that was passed in belongs to the caller and stays open -
+    the client is just dropped - since closing it would close that too.
+    """
+    clients = _CLIENTS.pop(asyncio.get_running_loop(), {})
+    for client, owns_http in clients.values():
+        if owns_http:
+            await client.close()
+
+
+class ClaudeService:
+    """Service for generating intelligent search queries using Claude AI"""
+
+    def __init__(self, http_client: Optional[httpx.AsyncClient] = None):
+        # Pass a shared http_client to reuse pooled connections across services
+        self._http_client = http_client
+        self.model = settings.CLAUDE_MODEL_SMART
+        self.fast_model = settings.CLAUDE_MODEL_FAST
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def client(self) -> "anthropic.AsyncAnthropic":
+        # Sync callers run on their thread's own loop, where the injected
+        # http_client's connections can't be used - give them their own
+        try:
+            on_thread_loop = asyncio.get_running_loop() is getattr(_THREAD_LOCAL, "loop", None)
+        except RuntimeError:
+            on_thread_loop = True
+        return get_client(None if on_thread_loop else self._http_client)
+
+    async def generate_queries(
+        self,
+        industry: str,
+        region: str,
+        top_k: int = 10,
+        serp_context: Optional[Dict[str, Any]] = None,
+        allow_fallback: bool = True
+    ) -> List[str]:
+        """
+        Generate intelligent search queries with full semantic understanding.
+
+        Args:
+            industry: Any business type/industry (can be short or long phrase)
+            region: Geographic location
+            top_k: Number of queries to generate
+            serp_context: Optional context from SERP (used as hints, not rules)
+            allow_fallback: Return template queries if Claude fails. Pass False
+                to get the error instead, e.g. so degraded output isn't cached.
+
+        Returns:
+            List of diverse, intelligent search queries
+        """
+        try:
+            queries, _ = await self.generate_queries_with_model(industry, region, top_k, serp_context)
+            return queries
+
+        except Exception as e:
+            self.logger.error(f"Error generating queries: {str(e)}")
+            if not allow_fallback:
+                raise
+            # Fallback to basic queries if Claude fails
+            return self._generate_fallback_queries(industry, region, top_k)
+
+    async def generate_queries_with_model(
+        self,
+        industry: str,
+        region: str,
+        top_k: int = 10,
+        serp_context: Optional[Dict[str, Any]] = None
+    ) -> Tuple[List[str], str]:
+        """
+        generate_queries without the fallback: the queries and the model that
+        actually wrote them (the smart tier if the fast one fell short).
+        Raises if Claude fails.
+        """
+        self.logger.info(f"Generating {top_k} queries for '{industry}' in '{region}'")
+
+        # Build the intelligent prompt
+        prompt = self._build_intelligent_prompt(industry, region, top_k, serp_context)
+
+        # Try the fast tier first - this is simple structured generation
+        model = self.fast_model
+        try:
+            validated_queries = await self._generate_on(model, prompt, top_k)
+        except Exception as e:
+            self.logger.warning(f"Fast model failed: {e}")
+            validated_queries = []
+
+        # Fall forward to the smart tier once if the fast one under-delivers.
+        # Not hedged - the hedge is spent on the first tier, so a request
+        # makes at most three Claude calls instead of four
+        if len(validated_queries) < (top_k + 1) // 2 and self.fast_model != self.model:
+            self.logger.info(f"Fast model returned {len(validated_queries)}/{top_k} queries, retrying on {self.model}")
+            model = self.model
+            validated_queries = await self._generate_on(model, prompt, top_k, hedge=False)
+
+        if not validated_queries:
+            raise ValueError("Claude returned no usable queries")
+
+        self.logger.info(f"Successfully generated {len(validated_queries)} queries on {model}")
+        return validated_queries, model
+
+    async def _generate_on(self, model: str, prompt: str, top_k: int, hedge: bool = True) -> List[str]:
+        """Run one prompt on the given model (hedged, see _hedged) and return the validated queries"""
+        call = lambda: self._complete_json(prompt, model=model, max_tokens=_max_tokens_for(top_k))
+        response_text = await (self._hedged(call) if hedge else call())
+        return self._parse_and_validate(response_text, top_k)
+
+    async def _hedged(self, call: Callable[[], Awaitable[str]]) -> str:
+        """
+        Run call(), and if it hasn't finished after CLAUDE_HEDGE_DELAY start an
+        identical second one. The first to succeed wins and the other is
+        cancelled, so one slow backend doesn't set the tail latency.
+        """
+        tasks = [asyncio.ensure_future(call())]
+        try:
+            delay = settings.CLAUDE_HEDGE_DELAY
+            if delay > 0:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    self.logger.info(f"No Claude response after {delay}s, sending hedged request")
+                    tasks.append(asyncio.ensure_future(call()))
+
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+
+            # Every attempt failed - surface the original error
+            return tasks[0].result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def stream_queries(
+        self,
+        industry: str,
+        region: str,
+        top_k: int = 10,
+        serp_context: Optional[Dict[str, Any]] = None,
+        allow_fallback: bool = True
+    ) -> AsyncIterator[str]:
+        """
+        Yield validated queries as soon as Claude finishes writing each one.
+
+        The stream is closed once top_k queries are out. If Claude fails
+        part-way, the remainder is topped up with fallback queries - or,
+        with allow_fallback=False, the error is raised after the queries
+        already yielded, so the caller knows the output is incomplete.
+        """
+        seen: Set[str] = set()
+        count = 0
+
+        try:
+            self.logger.info(f"Streaming {top_k} queries for '{industry}' in '{region}'")
+            prompt = self._build_intelligent_prompt(industry, region, top_k, serp_context)
+
+            async with _claude_slot(), self.client.messages.stream(
+                model=self.fast_model,
+                max_tokens=_max_tokens_for(top_k),
+                temperature=0.7,
+                system=_SYSTEM_BLOCKS,
+                messages=[{
+                    "role": "user",
+                    "content": prompt
+                }]
+            ) as stream:
+                buffer, pos = "", 0
+                async for text in stream.text_stream:
+                    buffer += text
+                    found, pos = self._drain_streamed_queries(buffer, pos)
+                    for query in found:
+                        if self._accept_query(query, seen):
+                            yield query
+                            count += 1
+                            if count >= top_k:
+                                return
+
+        except Exception as e:
+            self.logger.error(f"Error streaming queries: {str(e)}")
+            if not allow_fallback:
+                raise
+
+        if count < top_k and allow_fallback:
+            for query in self._generate_fallback_queries(industry, region, top_k):
+                if self._accept_query(query, seen):
+                    yield query
+                    count += 1
+                    if count >= top_k:
+                        break
+
+    async def generate_queries_batch(self, items: List[Dict[str, Any]]) -> List[List[str]]:
+        """
+        Generate queries for several requests with a single Claude call.
+
+        Args:
+            items: Dicts with industry, region, top_k and optional serp_context
+
+        Returns:
+            One validated query list per item, in input order (may be empty).
+            Raises if the call fails or the response doesn't match the inputs,
+            so the caller can retry the items one by one.
+        """
+        self.logger.info(f"Generating queries for a batch of {len(items)} requests")
+
+        prompt = self._build_batch_prompt(items)
+
+        response_text = await self._complete_json(
+            prompt,
+            model=self.fast_model,
+            max_tokens=_max_tokens_for(sum(item['top_k'] for item in items))
+        )
+        batches = self._parse_batch_response(response_text, len(items))
+
+        return [
+            self._validate_queries(queries, item['top_k'])
+            for item, queries in zip(items, batches)
+        ]
+
+    async def generate_queries_offline(
+        self,
+        items: List[Dict[str, Any]],
+        allow_fallback: bool = True
+    ) -> List[List[str]]:
+        """
+        Generate queries for bulk/offline jobs through the Message Batches API.
+
+        Batched requests are billed at half price but may take up to 24h, so
+        this is for scripts and background jobs - never the request path.
+
+        Args:
+            items: Dicts with industry, region, top_k and optional serp_context
+            allow_fallback: Give failed items fallback queries. With False
+                they get an empty list, so the caller can tell and retry them.
+
+        Returns:
+            One query list per item, in input order. Items whose request
+            errored or expired get fallback queries (see allow_fallback).
+        """
+        batch = await self.client.beta.messages.batches.create(requests=[
+            {
+                "custom_id": str(i),
+                "params": {
+                    "model": self.fast_model,
+                    "max_tokens": _max_tokens_for(item['top_k']),
+                    "temperature": 0.7,
+                    "system": _SYSTEM_BLOCKS,
+                    "messages": [{
+                        "role": "user",
+                        "content": self._build_intelligent_prompt(
+                            item['industry'], item['region'], item['top_k'], item.get('serp_context')
+                        )
+                    }]
+                }
+            }
+            for i, item in enumerate(items)
+        ])
+        self.logger.info(f"Submitted offline batch {batch.id} with {len(items)} requests")
+
+        while batch.processing_status != "ended":
+            await asyncio.sleep(settings.CLAUDE_BATCH_POLL_SECONDS)
+            batch = await self.client.beta.messages.batches.retrieve(batch.id)
+
+        # Results come back in arbitrary order - match them up by custom_id
+        texts: Dict[int, str] = {}
+        async for entry in await self.client.beta.messages.batches.results(batch.id):
+            if entry.result.type == "succeeded":
+                texts[int(entry.custom_id)] = entry.result.message.content[0].text
+
+        results = []
+        for i, item in enumerate(items):
+            try:
+                if i not in texts:
+                    raise ValueError("request errored or expired")
+                queries = self._parse_and_validate(texts[i], item['top_k'])
+            except Exception as e:
+                self.logger.error(f"Offline batch {batch.id} item {i} failed: {e}")
+                queries = (
+                    self._generate_fallback_queries(item['industry'], item['region'], item['top_k'])
+                    if allow_fallback else []
+                )
+            results.append(queries)
+
+        return results
+
+    async def analyze_industry(self, industry: str, region: str) -> IndustryAnalysis:
+        """
+        Break an industry down into the terms, titles and business types
+        QueryBuilderService expands queries from. Tries the fast tier, then
+        the smart one, like generate_queries. Never raises - falls back to a
+        minimal analysis built from the input.
+        """
+        prompt = self._build_analysis_prompt(industry, region)
+        for model in dict.fromkeys((self.fast_model, self.model)):
+            try:
+                response_text = await self._complete_json(
+                    prompt,
+                    model=model,
+                    max_tokens=700,
+                    system=_ANALYSIS_SYSTEM
+                )
+                match = _JSON_OBJECT_RE.search(response_text)
+                data = orjson.loads(match.group(0) if match else response_text)
+                analysis = IndustryAnalysis(**data)
+                if analysis.core_terms:
+                    return analysis
+                self.logger.warning(f"Empty industry analysis for '{industry}' from {model}")
+            except Exception as e:
+                self.logger.error(f"Error analyzing industry '{industry}' on {model}: {e}")
+
+        self.logger.warning(f"Using fallback industry analysis for '{industry}'")
+
+        return IndustryAnalysis(
+            core_terms=[industry],
+            role_titles=self._generate_role_titles(industry),
+            business_types=[industry]
+        )
+
+    async def generate_email_optimized_queries(
+        self,
+        industry_analysis: IndustryAnalysis,
+        geographic_data: GeographicData,
+        request: QueryRequest
+    ) -> Tuple[List[str], Optional[str]]:
+        """
+        Generate queries for a QueryBuilderService request, using the
+        industry analysis as the hint SERP context would otherwise give.
+        Returns the queries and the model that wrote them, or None for the
+        model if Claude failed and fallback queries were used.
+        """
+        hint_types = list(dict.fromkeys(industry_analysis.business_types + industry_analysis.core_terms))
+        region = geographic_data.primary_city or request.region
+        try:
+            return await self.generate_queries_with_model(
+                industry=request.industry,
+                region=region,
+                top_k=request.top_k,
+                serp_context={'primary_business_types': hint_types} if hint_types else None
+            )
+        except Exception as e:
+            self.logger.error(f"Error generating queries: {str(e)}")
+            return self._generate_fallback_queries(request.industry, region, request.top_k), None
+
+    async def generate_intelligent_queries_async(self, request: QueryRequest) -> List[str]:
+        """Async counterpart of generate_intelligent_queries taking a QueryRequest"""
+        return await self.generate_queries(request.industry, request.region, request.top_k)
+
+    def _build_analysis_prompt(self, industry: str, region: str) -> str:
+        return f"""INPUT:
+- Industry/Business Type: "{industry}"
+- Geographic Region: "{region}"
+
+Return ONLY a JSON object with these keys, each a list of up to 8 short strings:
+"core_terms" (names for this kind of business), "technical_terms" (specialties and services),
+"role_titles" (owner/decision-maker titles), "business_types" (company types),
+"related_industries" (adjacent sectors).
+No explanations, no markdown, no code blocks."""
+
+    def _generate_role_titles(self, industry: str) -> List[str]:
+        """Generic decision-maker titles for when Claude can't analyze the industry"""
+        return list(_role_titles(industry.strip()))
+
+    async def _complete_json(
+        self,
+        prompt: str,
+        model: str,
+        max_tokens: int = settings.CLAUDE_MAX_TOKENS,
+        system: Any = _SYSTEM_BLOCKS
+    ) -> str:
+        """
+        Stream a completion and stop reading as soon as the first top-level
+        JSON array/object closes, so trailing prose is never waited for.
+        """
+        buffer = ""
+        depth = start = 0
+        in_string = escaped = False
+
+        async with _claude_slot(), self.client.messages.stream(
+            model=model,
+            max_tokens=max_tokens,
+            temperature=0.7,  # Higher temperature for more creative variations
+            system=system,
+            messages=[{
+                "role": "user",
+                "content": prompt
+            }]
+        ) as stream:
+            async for text in stream.text_stream:
+                offset = len(buffer)
+                buffer += text
+                for i, ch in enumerate(text, offset):
+                    if in_string:
+                        if escaped:
+                            escaped = False
+                        elif ch == '\\':
+                            escaped = True
+                        elif ch == '"':
+                            in_string = False
+                    elif ch == '"':
+                        in_string = depth > 0
+                    elif ch in '[{':
+                        if depth == 0:
+                            start = i
+                        depth += 1
+                    elif ch in ']}' and depth:
+                        depth -= 1
+                        # Stop once a complete JSON value is in hand (a bracket
+                        # in leading prose like "[here]" won't parse)
+                        if depth == 0 and self._is_json(buffer[start:i + 1]):
+                            # Leaving the context manager closes the stream
+                            return buffer.strip()
+
+        return buffer.strip()
+
+    @staticmethod
+    def _is_json(text: str) -> bool:
+        try:
+            orjson.loads(text)
+            return True
+        except orjson.JSONDecodeError:
+            return False
+
+    def _build_batch_prompt(self, items: List[Dict[str, Any]]) -> str:
+        """Build one prompt covering several independent requests"""
+
+        inputs = []
+        for i, item in enumerate(items, 1):
+            line = (f'{i}. Industry/Business Type: "{item["industry"]}" | '
+                    f'Geographic Region: "{item["region"]}" | '
+                    f'Number of queries needed: {item["top_k"]}')
+            if item.get('serp_context'):
+                business_types = self._clean_serp_context(item['serp_context'])['business_types'][:5]
+                if business_types:
+                    line += f" | Related business types found (hint): {', '.join(business_types)}"
+            inputs.append(line)
+
+        n = len(items)
+        newline = "\n"
+
+        prompt = f"""You will handle {n} independent requests at once. Apply every rule to each request on its own.
+
+INPUTS:
+{newline.join(inputs)}
+
+OUTPUT FORMAT:
+Return ONLY a JSON array with {n} elements, one per input, in input order.
+Each element is a JSON array with exactly that input's number of query strings.
+No explanations, no markdown, no code blocks.
+
+Format: [["query1", "query2", ...], ["query1", "query2", ...], ...]
+
+Generate the queries for all {n} inputs now:"""
+
+        return prompt
+
+    def _parse_batch_response(self, response_text: str, expected_items: int) -> List[List[str]]:
+        """Parse a batched response into one query list per input"""
+
+        batches = orjson.loads(_extract_json_array(response_text))
+
+        if (not isinstance(batches, list) or len(batches) != expected_items
+                or not all(isinstance(b, list) for b in batches)):
+            raise ValueError(f"Expected {expected_items} query lists in batched response")
+
+        return [
+            [q.strip() for q in batch if isinstance(q, str) and len(q.strip()) > 10]
+            for batch in batches
+        ]
+
+    def _build_intelligent_prompt(
+        self,
+        industry: str,
+        region: str,
+        top_k: int,
+        serp_context: Optional[Dict[str, Any]]
+    ) -> str:
+        """Build an intelligent prompt that handles any input type"""
+
+        context_hint = self._build_context_hint(serp_context)
+
+        prompt = f"""INPUT:
+- Industry/Business Type: "{industry}"
+- Geographic Region: "{region}"
+- Number of queries needed: {top_k}
+
+YOUR TASK:
+Generate {top_k} highly diverse and intelligent Google search queries to find contacts in this industry, following the rules above.
 {context_hint}
 
 OUTPUT FORMAT:
@@ -272,70 +859,98 @@ Generate {top_k} diverse, intelligent queries now:"""
 
         return prompt
 
+    def _build_context_hint(self, serp_context: Optional[Dict[str, Any]]) -> str:
+        """Turn SERP context into a short prompt hint"""
+        if serp_context:
+            cleaned_context = self._clean_serp_context(serp_context)
+            if cleaned_context.get('business_types'):
+                return f"\n\nHINT from market research (use intelligently, ignore if irrelevant):\n- Related business types found: {', '.join(cleaned_context['business_types'][:5])}"
+        return ""
+
     def _clean_serp_context(self, serp_context: Dict[str, Any]) -> Dict[str, Any]:
         """Clean garbage from SERP context"""
 
-        business_types = serp_context.get('primary_business_types', [])
-
-        # Filter out garbage patterns
-        garbage_patterns = [
-            r'^\d+$',  # Just numbers like "4"
-            r'^company_page$',  # Metadata
-            r'^@[\w\.-]+$',  # Email domains
-            r'^[A-Z]{2,}$',  # Random acronyms
-            r'^(www|http|https)',  # URLs
-            r'^\W+$',  # Only special characters
-        ]
-
-        cleaned_types = []
-        for btype in business_types:
-            if not btype or len(btype) < 3:
-                continue
-
-            is_garbage = any(re.match(pattern, str(btype), re.IGNORECASE)
-                           for pattern in garbage_patterns)
-
-            if not is_garbage:
-                cleaned_types.append(btype)
+        # SERP context repeats per industry/region, so the filtering is cached
+        business_types = _clean_business_types(tuple(serp_context.get('primary_business_types') or ()))
 
         return {
-            'business_types': cleaned_types[:10],  # Top 10 relevant types
+            'business_types': list(business_types),
             'is_b2b': serp_context.get('is_b2b', True)
         }
 
-    def _parse_claude_response(self, response_text: str, expected_count: int) -> List[str]:
-        """Parse Claude's response and extract queries"""
+    def _parse_and_validate(self, response_text: str, expected_count: int) -> List[str]:
+        """
+        Parse Claude's response into validated queries in a single pass,
+        stopping as soon as expected_count have been accepted
+        """
 
         try:
-            # Remove markdown code blocks if present
-            response_text = re.sub(r'```json\s*|\s*```', '', response_text)
-            response_text = response_text.strip()
-
-            # Try to find JSON array
-            json_match = re.search(r'\[.*\]', response_text, re.DOTALL)
-            if json_match:
-                response_text = json_match.group(0)
-
-            # Parse JSON
-            queries = json.loads(response_text)
+            # Parse the JSON array (ignores markdown code blocks around it)
+            queries = orjson.loads(_extract_json_array(response_text))
 
             if isinstance(queries, list):
-                # Clean each query
-                cleaned_queries = []
+                valid_queries = []
+                seen = set()
                 for q in queries:
-                    if isinstance(q, str) and len(q.strip()) > 10:
-                        cleaned_queries.append(q.strip())
+                    if isinstance(q, str) and self._accept_query(q.strip(), seen):
+                        valid_queries.append(q.strip())
+                        if len(valid_queries) >= expected_count:
+                            break
 
-                return cleaned_queries[:expected_count]
+                return valid_queries
 
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             self.logger.error(f"JSON parse error: {e}")
-            self.logger.debug(f"Response text: {response_text[:500]}")
+            self.logger.debug("Response text: %.500s", response_text)
         except Exception as e:
             self.logger.error(f"Unexpected error parsing response: {e}")
 
         return []
 
+    def _drain_streamed_queries(self, buffer: str, pos: int) -> Tuple[List[str], int]:
+        """
+        Pull every complete query string out of a partially streamed JSON
+        array, starting at pos. Returns the queries and the next scan position.
+        """
+        if pos == 0:
+            start = buffer.find('[')
+            if start < 0:
+                return [], 0
+            pos = start + 1
+
+        found = []
+        for match in _JSON_STRING_RE.finditer(buffer, pos):
+            try:
+                found.append(orjson.loads(match.group(0)).strip())
+            except orjson.JSONDecodeError:
+                pass
+            pos = match.end()
+
+        return found, pos
+
+    def _accept_query(self, query: str, seen: Set[str]) -> bool:
+        """Check a single query, remembering it in seen if it's kept"""
+
+        # Skip duplicates
+        normalized = query.lower().strip()
+        if normalized in seen:
+            return False
+
+        # Basic validation
+        if len(query) < 15:  # Too short
+            return False
+
+        # Check for proper quote usage
+        if '"' not in query:  # No quotes at all
+            return False
+
+        # Check for garbage patterns
+        if _QUERY_GARBAGE_RE.search(query):
+            return False
+
+        seen.add(normalized)
+        return True
+
     def _validate_queries(self, queries: List[str], expected_count: int) -> List[str]:
         """Validate and clean queries"""
 
@@ -343,24 +958,9 @@ Generate {top_k} diverse, intelligent queries now:"""
         seen = set()
 
         for query in queries:
-            # Skip duplicates
-            normalized = query.lower().strip()
-            if normalized in seen:
+            if not self._accept_query(query, seen):
                 continue
 
-            # Basic validation
-            if len(query) < 15:  # Too short
-                continue
-
-            # Check for proper quote usage
-            if '"' not in query:  # No quotes at all
-                continue
-
-            # Check for garbage patterns
-            if any(garbage in query for garbage in ['undefined', 'null', 'example', 'placeholder']):
-                continue
-
-            seen.add(normalized)
             valid_queries.append(query)
 
             if len(valid_queries) >= expected_count:
@@ -374,7 +974,12 @@ Generate {top_k} diverse, intelligent queries now:"""
         region: str,
         top_k: int
     ) -> List[str]:
-        """Generate basic B2C fallback queries if Claude fails"""
+        """
+        Generate basic B2C fallback queries if Claude fails.
+
+        Always returns top_k queries. Each variation and location yields 31
+        distinct ones; past that the distinct queries repeat in order.
+        """
 
         self.logger.warning("Using fallback query generation")
 
@@ -383,21 +988,18 @@ Generate {top_k} diverse, intelligent queries now:"""
 
         # Try to extract meaningful variations
         # If input is "Insurance Brokers", variations could be "Insurance Agency", "Insurance Services"
-        variations = [
-            industry_clean,
-            industry_clean.replace("Brokers", "Agency").replace("brokers", "agency"),
-            industry_clean.replace("Brokers", "Services").replace("brokers", "services"),
-            industry_clean.replace("Brokers", "Company").replace("brokers", "company"),
-            industry_clean.replace("Brokers", "Firm").replace("brokers", "firm"),
-        ]
+        variations = [industry_clean]
+        if _BROKERS_RE.search(industry_clean):
+            variations.extend(
+                _BROKERS_RE.sub(
+                    lambda m, suffix=suffix: suffix if m.group()[0].isupper() else suffix.lower(),
+                    industry_clean
+                )
+                for suffix in _BROKER_SUFFIXES
+            )
 
         # Remove duplicates while preserving order
-        seen = set()
-        unique_variations = []
-        for v in variations:
-            if v not in seen:
-                seen.add(v)
-                unique_variations.append(v)
+        unique_variations = list(dict.fromkeys(variations))
 
         # Geographic variations
         locations = [region]
@@ -410,38 +1012,43 @@ Generate {top_k} diverse, intelligent queries now:"""
         elif "San Francisco" in region:
             locations.extend(["Downtown SF", "Mission District", "SOMA"])
 
-        # Email domains to rotate
-        email_domains = ["@gmail.com", "@yahoo.com", "@outlook.com", "@hotmail.com", "@aol.com"]
-
-        # Domain patterns
-        domains = [".com", ".org", ".net"]
-
-        # Generate diverse B2C queries
-        queries = []
-        patterns = [
-            'site:{domain} "{industry}" "{location}" "{email}"',
-            'site:{domain} "{industry}" "{location}" contact',
-            '"{industry}" "{location}" "{email}" -linkedin -jobs',
-            'site:{domain} "{industry}" "{location}" email',
-            '"{industry}" "{location}" "{email}" -indeed -careers',
-        ]
-
-        for i in range(top_k):
-            pattern = patterns[i % len(patterns)]
-            industry_var = unique_variations[i % len(unique_variations)]
-            location = locations[i % len(locations)]
-            email = email_domains[i % len(email_domains)]
-            domain = domains[i % len(domains)]
-
-            query = pattern.format(
-                industry=industry_var,
-                location=location,
-                email=email,
-                domain=domain
-            )
-            queries.append(query)
-
-        return queries[:top_k]
+        # Start the pattern/email/domain rotations at offsets seeded by the
+        # input, so different searches get different mixes but the same
+        # search always gets the same queries (cache-friendly)
+        seed = zlib.crc32(f"{industry_clean.lower()}|{region.strip().lower()}".encode())
+
+        patterns = _rotated(_FALLBACK_PATTERNS, seed)
+        emails = _rotated(_FALLBACK_EMAIL_DOMAINS, seed >> 8)
+        tlds = _rotated(_FALLBACK_TLDS, seed >> 16)
+
+        # Walk every combination once, patterns varying fastest. Each slower
+        # dimension is shifted by the digits below it, so consecutive rows
+        # change variation, location, email and TLD together with the pattern
+        # instead of the first rows all sharing one email and TLD. The shift
+        # is a bijection, so every combination is still visited.
+        queries: Dict[str, None] = {}
+        for t, e, l, v, p in product(
+            range(len(tlds)),
+            range(len(emails)),
+            range(len(locations)),
+            range(len(unique_variations)),
+            range(len(patterns))
+        ):
+            shift = p + v
+            location = locations[(l + shift) % len(locations)]
+            shift += l
+            email = emails[(e + shift) % len(emails)]
+            shift += e
+            domain = tlds[(t + shift) % len(tlds)]
+            industry_var = unique_variations[(v + p) % len(unique_variations)]
+            # Patterns without an email or TLD repeat across those, so skip repeats
+            queries[patterns[p](industry_var, location, email, domain)] = None
+            if len(queries) >= top_k:
+                return list(queries)
+
+        # Only 31 distinct queries exist per variation and location, so cycle
+        # them to still hand back top_k
+        return list(islice(cycle(queries), top_k))
 
     def generate_intelligent_queries(
         self,
@@ -452,8 +1059,8 @@ Generate {top_k} diverse, intelligent queries now:"""
         **kwargs  # Catch any extra arguments
     ) -> List[str]:
         """
-        Synchronous wrapper for generate_queries.
-        Bulletproof version that handles any calling pattern.
+        Synchronous wrapper for generate_queries, for scripts and other sync
+        code only - async callers should await generate_queries directly.
 
         Usage (all these work):
             service.generate_intelligent_queries("Insurance", "New York", 10)
@@ -476,29 +1083,22 @@ Generate {top_k} diverse, intelligent queries now:"""
 
         self.logger.info(f"Generating queries: industry='{industry}', region='{region}', top_k={top_k}")
 
+        # Blocking here would stall every other request on the loop
         try:
-            # Try to use existing event loop
-            loop = asyncio.get_event_loop()
-            if loop.is_running():
-                # Create a new loop in a thread if current loop is running
-                import concurrent.futures
-                with concurrent.futures.ThreadPoolExecutor() as executor:
-                    future = executor.submit(
-                        asyncio.run,
-                        self.generate_queries(industry, region, top_k, serp_context)
-                    )
-                    return future.result()
-            else:
-                # Use existing loop
-                return loop.run_until_complete(
-                    self.generate_queries(industry, region, top_k, serp_context)
-                )
+            asyncio.get_running_loop()
         except RuntimeError:
-            # No event loop exists, create one
-            return asyncio.run(
+            pass
+        else:
+            raise RuntimeError(
+                "generate_intelligent_queries() can't be called from a running event loop - "
+                "await generate_queries() instead"
+            )
+
+        try:
+            return _thread_loop().run_until_complete(
                 self.generate_queries(industry, region, top_k, serp_context)
             )
         except Exception as e:
             self.logger.error(f"Error in generate_intelligent_queries: {e}", exc_info=True)
             # Fall back to sync generation
-            return self._generate_fallback_queries(industry, region, top_k)
\ No newline at end of file
+            return self._generate_fallback_queries(industry, region, top_k)
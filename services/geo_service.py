@@ -2,6 +2,7 @@
 Simplified geographic service with reliable fallbacks
 """
 import logging
+from functools import lru_cache
 from models import GeographicData
 
 logger = logging.getLogger(__name__)
@@ -54,25 +55,74 @@ class GeographicService:
             }
         }
 
+        # Map alternative names ("NYC", "Bombay") to their city key.
+        # Names shared by several cities ("The City") are left out.
+        alias_owners = {}
+        for city, data in self.city_data.items():
+            for name in data['local_names'] + [city]:
+                alias_owners.setdefault(name.lower(), set()).add(city)
+        self.aliases = {
+            name: cities.pop() for name, cities in alias_owners.items() if len(cities) == 1
+        }
+
+        # Known cities are validated once here instead of on every request
+        self.city_geo = {
+            city: GeographicData(primary_city=city.title(), canonical_city=city.title(), **data)
+            for city, data in self.city_data.items()
+        }
+
+        # Regions are resolved on demand. Keyed on the region as given, since
+        # primary_city keeps the caller's spelling ("NYC" stays "NYC").
+        self._resolve_cached = lru_cache(maxsize=1024)(self._resolve)
+        # Serialized form for response meta, dumped once per region
+        self._dump_cached = lru_cache(maxsize=1024)(
+            lambda region: self._resolve_cached(region).model_dump()
+        )
+        self._terms_cached = lru_cache(maxsize=1024)(self._geo_terms)
+
+    def canonical_region(self, region: str) -> str:
+        """Normalize a region name, folding known aliases onto one city"""
+        region_lower = " ".join(region.lower().split())
+        return self.aliases.get(region_lower, region_lower)
+
     async def resolve_geography(self, region: str) -> GeographicData:
         """
         Always returns valid geographic data
         """
+        # Pure lookup with no I/O - repeat regions get the same shared object
+        return self._resolve_cached(region.strip())
+
+    def resolve_geography_dict(self, region: str) -> dict:
+        """
+        resolve_geography as a plain dict. Shared across requests - don't mutate.
+        """
+        return self._dump_cached(region.strip())
+
+    def resolve_geography_terms(self, region: str) -> frozenset:
+        """
+        Lowercased city, neighborhood and metro names for a region,
+        built once per region for geographic coverage scoring
+        """
+        return self._terms_cached(region.strip())
+
+    def _geo_terms(self, region: str) -> frozenset:
+        geo = self._resolve_cached(region)
+        return frozenset(
+            term.lower() for term in (geo.primary_city, geo.canonical_city, *geo.neighborhoods, *geo.metro_areas)
+            if term
+        )
+
+    def _resolve(self, region: str) -> GeographicData:
         try:
-            region_lower = region.lower().strip()
-
-            # Check if we have specific data for this city
-            if region_lower in self.city_data:
-                data = self.city_data[region_lower]
-                return GeographicData(
-                    primary_city=region,
-                    neighborhoods=data['neighborhoods'],
-                    metro_areas=data['metro_areas'],
-                    local_names=data['local_names'],
-                    country_code=data['country_code'],
-                    languages=data['languages'],
-                    business_tlds=data['business_tlds']
-                )
+            # Known cities (and their aliases) reuse the prebuilt data, with
+            # the canonical name in canonical_city and the caller's spelling
+            # kept as primary_city
+            city = self.aliases.get(" ".join(region.lower().split()))
+            if city:
+                geo = self.city_geo[city]
+                if region == geo.primary_city:
+                    return geo
+                return geo.model_copy(update={"primary_city": region})
 
             # Generic fallback for any other city
             return GeographicData(
@@ -96,4 +146,10 @@ class GeographicService:
                 country_code="US",
                 languages=["en"],
                 business_tlds=[".com"]
-            )
\ No newline at end of file
+            )
+
+
+@lru_cache()
+def get_geographic_service() -> GeographicService:
+    """Shared GeographicService, built on first use instead of at import"""
+    return GeographicService()
@@ -1,49 +1,99 @@
 """
 Main query builder service that coordinates all components
 """
-import uuid
+import asyncio
+import secrets
 import time
 import logging
-from typing import Dict, Any
+import re
+from collections import Counter
+from itertools import cycle, islice
+from typing import Callable, Dict, Any, Optional, Tuple
 from models import QueryRequest, QueryResponse, QueryAnalytics
 from services.claude_service import ClaudeService
-from services.geo_service import GeographicService
+from services.geo_service import get_geographic_service
 from config import settings
 
 logger = logging.getLogger(__name__)
 
+# Every email provider in one alternation - a single pass per query
+_PROVIDERS_RE = re.compile('|'.join(re.escape(p) for p in settings.EMAIL_PROVIDERS))
+# Search operators and their argument ("site:.com"), found in one pass
+_OPERATOR_RE = re.compile(r'(?<!\S)(?:site|intitle|inurl|filetype|intext):\S*')
+# Quoted search terms ("dentist", "boston")
+_QUOTED_RE = re.compile(r'"([^"]*)"')
+# Fallback queries: one per email provider, in rotation
+_FALLBACK_PROVIDERS = tuple(f'"@{provider}"' for provider in settings.EMAIL_PROVIDERS)
+
+# Operator -> analytics bucket, in reporting order
+_PATTERN_NAMES = (
+    ('site:', 'site_targeted'),
+    ('filetype:', 'document_search'),
+    ('intitle:', 'title_search'),
+    ('inurl:', 'url_search'),
+)
+
+
+def request_filter(request: QueryRequest) -> Callable[[str], Optional[str]]:
+    """
+    The request's includes/excludes/personal_only as one per-query step:
+    returns the query to send, or None to drop it
+    """
+    # Filters are per request - lowercase/assemble them once, not per query
+    includes_lower = [term.lower() for term in request.includes or () if term]
+    exclude_terms = " ".join(f'-site:{term}' for term in request.excludes or () if term)
+    personal_only = request.personal_only
+
+    def apply(query: str) -> Optional[str]:
+        # Personal-email searches name a free provider ("@gmail.com")
+        if personal_only and not _PROVIDERS_RE.search(query):
+            return None
+
+        # Check if any include terms are present
+        if includes_lower:
+            query_lower = query.lower()
+            if not any(term in query_lower for term in includes_lower):
+                return None
+
+        # Add excludes to query if specified
+        if exclude_terms and exclude_terms not in query:
+            query += f" {exclude_terms}"
+        return query
+
+    return apply
+
 
 class QueryBuilderService:
     """Main service that coordinates query building process"""
 
     def __init__(self):
         self.claude_service = ClaudeService()
-        self.geo_service = GeographicService()
+
+    @property
+    def geo_service(self):
+        return get_geographic_service()
 
     async def build_queries(self, request: QueryRequest) -> QueryResponse:
         """
         Main method to build optimized search queries
         """
-        start_time = time.time()
-        request_id = str(uuid.uuid4())[:8]
+        start_ns = time.monotonic_ns()
+        request_id = secrets.token_hex(4)
 
         logger.info(f"[{request_id}] Building queries for {request.industry} in {request.region}")
 
         try:
-            # Step 1: Analyze industry for semantic expansion
-            logger.info(f"[{request_id}] Analyzing industry: {request.industry}")
-            industry_analysis = await self.claude_service.analyze_industry(
-                request.industry,
-                request.region
+            # Step 1+2: Analyze industry for semantic expansion and resolve
+            # geographic intelligence - independent, so run them together
+            logger.info(f"[{request_id}] Analyzing industry '{request.industry}' and resolving geography '{request.region}'")
+            industry_analysis, geographic_data = await asyncio.gather(
+                self.claude_service.analyze_industry(request.industry, request.region),
+                self.geo_service.resolve_geography(request.region)
             )
 
-            # Step 2: Resolve geographic intelligence
-            logger.info(f"[{request_id}] Resolving geography: {request.region}")
-            geographic_data = await self.geo_service.resolve_geography(request.region)
-
             # Step 3: Generate optimized queries using Claude
             logger.info(f"[{request_id}] Generating {request.top_k} optimized queries")
-            queries = await self.claude_service.generate_email_optimized_queries(
+            queries, model_used = await self.claude_service.generate_email_optimized_queries(
                 industry_analysis,
                 geographic_data,
                 request
@@ -60,20 +110,21 @@ class QueryBuilderService:
                 request
             )
 
-            execution_time = time.time() - start_time
+            execution_time = (time.monotonic_ns() - start_ns) / 1e9
 
-            # Build response
-            response = QueryResponse(
+            # Build response - every field is built here from validated
+            # values, so skip re-validating them
+            response = QueryResponse.model_construct(
                 queries=final_queries,
                 meta={
-                    "industry_analysis": industry_analysis.dict(),
-                    "geographic_data": geographic_data.dict(),
+                    "industry_analysis": industry_analysis.model_dump(),
+                    "geographic_data": self.geo_service.resolve_geography_dict(request.region),
                     "execution_time_seconds": round(execution_time, 2),
                     "query_count": len(final_queries),
-                    "model_used": settings.CLAUDE_MODEL,
+                    "model_used": model_used,  # None when fallback queries were used
                     "timestamp": int(time.time())
                 },
-                analytics=analytics.dict(),
+                analytics=analytics.model_dump(),
                 request_id=request_id
             )
 
@@ -91,6 +142,7 @@ class QueryBuilderService:
         """
         processed_queries = []
         seen_patterns = set()
+        apply_filters = request_filter(request)
 
         for query in queries:
             # Clean and validate
@@ -104,46 +156,34 @@ class QueryBuilderService:
                 continue
             seen_patterns.add(query_pattern)
 
-            # Apply user-specified includes/excludes
-            if request.includes:
-                # Check if any include terms are present
-                if not any(term.lower() in cleaned_query.lower() for term in request.includes):
-                    continue
-
-            # Add excludes to query if specified
-            if request.excludes:
-                exclude_terms = " ".join([f'-site:{term}' for term in request.excludes if term])
-                if exclude_terms and exclude_terms not in cleaned_query:
-                    cleaned_query += f" {exclude_terms}"
+            # Apply user-specified includes/excludes/personal_only
+            cleaned_query = apply_filters(cleaned_query)
+            if cleaned_query is None:
+                continue
 
             processed_queries.append(cleaned_query)
 
-        # Ensure we have the requested number of queries
-        while len(processed_queries) < request.top_k and len(processed_queries) < len(queries):
-            # Add back some queries if we filtered too many
-            break
-
         return processed_queries[:request.top_k]
 
-    def _extract_pattern(self, query: str) -> str:
+    def _extract_pattern(self, query: str) -> Tuple[str, ...]:
         """
-        Extract pattern from query for deduplication
+        Extract pattern from query for deduplication, as a hashable key:
+        its search operators plus the quoted terms it searches for.
+        Queries that differ only in email provider share a pattern.
         """
-        # Remove specific terms to identify pattern similarity
         pattern = query.lower()
 
         # Remove email providers
-        for provider in settings.EMAIL_PROVIDERS:
-            pattern = pattern.replace(provider, "EMAIL")
+        pattern = _PROVIDERS_RE.sub("EMAIL", pattern)
 
-        # Remove quotes and specific terms
-        pattern = pattern.replace('"', '').replace("'", '')
+        # What the query searches for
+        terms = tuple(" ".join(term.split()) for term in _QUOTED_RE.findall(pattern))
 
-        # Extract base structure
-        words = pattern.split()
-        structure_words = [w for w in words if w in ['site:', 'intitle:', 'inurl:', 'filetype:', 'intext:']]
+        # Remove quotes
+        pattern = pattern.replace('"', '').replace("'", '')
 
-        return " ".join(structure_words)
+        # How it searches: each search operator with its argument
+        return tuple(_OPERATOR_RE.findall(pattern)) + terms
 
     def _generate_analytics(self,
                             queries: list,
@@ -153,50 +193,49 @@ class QueryBuilderService:
         """
         Generate analytics about the query generation process
         """
-        # Count unique terms used
+        # One pass over the queries for terms, providers, operators and patterns
         all_terms = set()
+        email_distribution = Counter()
+        pattern_distribution = Counter()
+        patterns = set()
         for query in queries:
-            words = query.lower().replace('"', '').split()
-            all_terms.update(words)
-
-        # Email provider distribution
-        email_distribution = {}
-        for provider in settings.EMAIL_PROVIDERS:
-            count = sum(1 for query in queries if provider in query)
-            if count > 0:
-                email_distribution[provider] = count
-
-        # Pattern distribution
-        pattern_distribution = {}
-        for query in queries:
-            if 'site:' in query:
-                pattern_distribution['site_targeted'] = pattern_distribution.get('site_targeted', 0) + 1
-            if 'filetype:' in query:
-                pattern_distribution['document_search'] = pattern_distribution.get('document_search', 0) + 1
-            if 'intitle:' in query:
-                pattern_distribution['title_search'] = pattern_distribution.get('title_search', 0) + 1
-            if 'inurl:' in query:
-                pattern_distribution['url_search'] = pattern_distribution.get('url_search', 0) + 1
+            patterns.add(self._extract_pattern(query))
+            all_terms.update(query.lower().replace('"', '').split())
+            email_distribution.update(set(_PROVIDERS_RE.findall(query)))
+            pattern_distribution.update(
+                name for operator, name in _PATTERN_NAMES if operator in query
+            )
 
         # Geographic coverage
-        geo_terms_used = len([
-            term for term in all_terms
-            if term in [geographic_data.primary_city.lower()] +
-               [area.lower() for area in geographic_data.neighborhoods + geographic_data.metro_areas]
-        ])
+        geo_terms = self.geo_service.resolve_geography_terms(request.region)
+        geo_terms_used = len(all_terms & geo_terms)
 
-        return QueryAnalytics(
+        # Counts and dicts computed above - nothing to validate
+        return QueryAnalytics.model_construct(
             total_generated=len(queries),
             unique_terms_used=len(all_terms),
             geographic_coverage=geo_terms_used,
-            email_provider_distribution=email_distribution,
-            pattern_distribution=pattern_distribution,
-            estimated_coverage=self._estimate_coverage(queries, industry_analysis, geographic_data)
+            email_provider_distribution={
+                provider: email_distribution[provider]
+                for provider in settings.EMAIL_PROVIDERS if email_distribution[provider]
+            },
+            pattern_distribution=dict(pattern_distribution),
+            estimated_coverage=self._estimate_coverage(
+                industry_analysis,
+                geographic_data,
+                unique_patterns=len(patterns),
+                providers_used=len(email_distribution)
+            )
         )
 
-    def _estimate_coverage(self, queries: list, industry_analysis, geographic_data) -> str:
+    def _estimate_coverage(self,
+                           industry_analysis,
+                           geographic_data,
+                           unique_patterns: int,
+                           providers_used: int) -> str:
         """
-        Estimate the search coverage based on query diversity
+        Estimate the search coverage based on query diversity.
+        Pattern and provider counts come from _generate_analytics' pass over the queries.
         """
         diversity_score = 0
 
@@ -209,11 +248,9 @@ class QueryBuilderService:
         diversity_score += min(geo_terms_covered / 5, 1.0) * 25
 
         # Query pattern diversity
-        unique_patterns = len(set(self._extract_pattern(q) for q in queries))
         diversity_score += min(unique_patterns / 5, 1.0) * 25
 
         # Email provider distribution
-        providers_used = len([p for p in settings.EMAIL_PROVIDERS if any(p in q for q in queries)])
         diversity_score += min(providers_used / len(settings.EMAIL_PROVIDERS), 1.0) * 20
 
         if diversity_score >= 80:
@@ -230,28 +267,27 @@ class QueryBuilderService:
         Create a fallback response when main processing fails
         """
         # Generate basic fallback queries
-        fallback_queries = []
-
-        for i, provider in enumerate(settings.EMAIL_PROVIDERS[:request.top_k]):
-            query = f'site:.com "{request.industry}" "{request.region}" "@{provider}"'
-            fallback_queries.append(query)
-
-        # Pad with additional basic queries if needed
-        while len(fallback_queries) < request.top_k:
-            provider = settings.EMAIL_PROVIDERS[len(fallback_queries) % len(settings.EMAIL_PROVIDERS)]
-            query = f'"{request.industry}" "{request.region}" "@{provider}"'
-            fallback_queries.append(query)
-
-        fallback_analytics = QueryAnalytics(
-            total_generated=len(fallback_queries),
-            unique_terms_used=3,  # Basic estimate
-            geographic_coverage=1,
-            email_provider_distribution={provider: 1 for provider in settings.EMAIL_PROVIDERS[:request.top_k]},
-            pattern_distribution={"basic": len(fallback_queries)},
-            estimated_coverage="Limited (fallback mode)"
-        )
-
-        return QueryResponse(
+        base = f'"{request.industry}" "{request.region}"'
+        fallback_queries = [
+            f'site:.com {base} {provider}'
+            for provider in _FALLBACK_PROVIDERS[:request.top_k]
+        ]
+
+        # Pad with additional basic queries if needed, continuing the rotation
+        providers = islice(cycle(_FALLBACK_PROVIDERS), len(fallback_queries), request.top_k)
+        fallback_queries.extend(f'{base} {provider}' for provider in providers)
+
+        # Same shape as QueryAnalytics.model_dump(), without validating known-good values
+        fallback_analytics = {
+            "total_generated": len(fallback_queries),
+            "unique_terms_used": 3,  # Basic estimate
+            "geographic_coverage": 1,
+            "email_provider_distribution": dict.fromkeys(settings.EMAIL_PROVIDERS[:request.top_k], 1),
+            "pattern_distribution": {"basic": len(fallback_queries)},
+            "estimated_coverage": "Limited (fallback mode)"
+        }
+
+        return QueryResponse.model_construct(
             queries=fallback_queries,
             meta={
                 "error": error,
@@ -261,6 +297,6 @@ class QueryBuilderService:
                 "query_count": len(fallback_queries),
                 "timestamp": int(time.time())
             },
-            analytics=fallback_analytics.dict(),
+            analytics=fallback_analytics,
             request_id=request_id
         )
\ No newline at end of file
@@ -0,0 +1,112 @@
+"""
+Semantic cache for near-duplicate industry/region requests
+"""
+import asyncio
+import importlib.util
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from config import settings
+from services.geo_service import get_geographic_service
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticCache:
+    """
+    Reuses responses for requests that mean the same thing
+    ("NYC" vs "New York City", "fintech" vs "FinTech companies").
+
+    Only industry + region are embedded; every other request field must
+    match exactly, so a hit never returns the wrong number of queries.
+    The embedding model and FAISS index are loaded on first use. Errors
+    never fail a request - they are logged and treated as a miss, and if
+    the model can't be loaded the cache turns itself off.
+    """
+
+    def __init__(self):
+        for module in ("sentence_transformers", "faiss"):
+            if importlib.util.find_spec(module) is None:
+                raise ImportError(f"{module} is not installed")
+
+        self.threshold = settings.SEMANTIC_CACHE_THRESHOLD
+        self.max_entries = settings.SEMANTIC_CACHE_MAX_ENTRIES
+        self._model = None
+        self._index = None
+        self._entries: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._disabled = False
+
+    def _load(self):
+        if self._model is None:
+            import faiss
+            from sentence_transformers import SentenceTransformer
+
+            model = SentenceTransformer(settings.SEMANTIC_CACHE_MODEL)
+            self._index = faiss.IndexFlatIP(model.get_sentence_embedding_dimension())
+            self._model = model  # Set last - None means "not loaded" to _failed
+            logger.info(f"Loaded semantic cache model {settings.SEMANTIC_CACHE_MODEL}")
+
+    def _normalize(self, industry: str, region: str) -> str:
+        industry_clean = " ".join(industry.lower().split())
+        return f"{industry_clean} | {get_geographic_service().canonical_region(region)}"
+
+    def _embed(self, text: str):
+        # L2-normalized, so inner product == cosine similarity
+        return self._model.encode([text], normalize_embeddings=True).astype("float32")
+
+    def _lookup_sync(self, text: str, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._load()
+            if not self._entries:
+                return None
+
+            scores, ids = self._index.search(self._embed(text), min(5, len(self._entries)))
+            for score, idx in zip(scores[0], ids[0]):
+                if idx < 0 or score < self.threshold:
+                    break
+                entry = self._entries[idx]
+                if entry["params"] == params:
+                    logger.info(f"Semantic cache hit ({score:.3f}): '{text}' ~ '{entry['text']}'")
+                    return entry["response"]
+        return None
+
+    def _add_sync(self, text: str, params: Dict[str, Any], response: Dict[str, Any]):
+        with self._lock:
+            self._load()
+            if len(self._entries) >= self.max_entries:
+                self._index.reset()
+                self._entries.clear()
+
+            self._index.add(self._embed(text))
+            self._entries.append({"text": text, "params": params, "response": response})
+
+    def _failed(self, action: str, e: Exception):
+        if self._model is None:
+            # Missing download, bad model name... every call would fail the same way
+            self._disabled = True
+            logger.warning(f"Semantic cache disabled, model failed to load: {e}")
+        else:
+            logger.warning(f"Semantic cache {action} failed: {e}")
+
+    async def lookup(self, industry: str, region: str, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Return a cached response for a near-identical request, if any"""
+        if self._disabled:
+            return None
+        try:
+            text = self._normalize(industry, region)
+            return await asyncio.to_thread(self._lookup_sync, text, params)
+        except Exception as e:
+            self._failed("read", e)
+            return None
+
+    async def add(self, industry: str, region: str, params: Dict[str, Any], response: Dict[str, Any]):
+        """Remember a freshly generated response"""
+        if self._disabled:
+            return
+        try:
+            text = self._normalize(industry, region)
+            await asyncio.to_thread(self._add_sync, text, params, response)
+        except Exception as e:
+            self._failed("write", e)
@@ -0,0 +1,135 @@
+import asyncio
+
+from services.batcher import QueryBatcher
+
+
+class FakeClaude:
+    """Stands in for ClaudeService: one query per requested slot, or an error"""
+
+    fast_model = "fast"
+
+    def __init__(self, failing=(), batch_fails=False, short=False):
+        self.failing = set(failing)
+        self.batch_fails = batch_fails
+        self.short = short
+        self.calls = 0
+
+    def _queries(self, industry, top_k):
+        if industry in self.failing:
+            raise RuntimeError(f"{industry} failed")
+        count = 1 if self.short else top_k
+        return [f'"{industry}" query {i}' for i in range(count)]
+
+    async def generate_queries_with_model(self, industry, region, top_k=10, serp_context=None):
+        self.calls += 1
+        return self._queries(industry, top_k), self.fast_model
+
+    async def generate_queries_batch(self, items):
+        self.calls += 1
+        if self.batch_fails:
+            raise RuntimeError("batch failed")
+        return [[] if item["industry"] in self.failing else self._queries(item["industry"], item["top_k"])
+                for item in items]
+
+
+def _item(industry, top_k):
+    return {"industry": industry, "region": "Boston", "top_k": top_k, "serp_context": None}
+
+
+def test_group_packs_by_top_k_under_query_budget():
+    batcher = QueryBatcher(FakeClaude())
+    batcher.max_queries = 30
+    batch = [(_item(name, top_k), None) for name, top_k in (("a", 20), ("b", 5), ("c", 10), ("d", 15))]
+
+    groups = batcher._group(batch)
+
+    assert [[item["industry"] for item, _ in group] for group in groups] == [["b", "c", "d"], ["a"]]
+
+
+def test_generate_group_isolates_failures():
+    batcher = QueryBatcher(FakeClaude(failing={"bad"}, batch_fails=True))
+
+    results = asyncio.run(batcher._generate_group([_item("good", 2), _item("bad", 2)]))
+
+    assert results[0] == (['"good" query 0', '"good" query 1'], "fast")
+    assert isinstance(results[1], RuntimeError)
+
+
+def test_results_are_cached_until_ttl():
+    claude = FakeClaude()
+    batcher = QueryBatcher(claude)
+
+    async def run():
+        first = await batcher.submit("Dentists", "Boston", 3)
+        again = await batcher.submit("dentists", "BOSTON", 3)
+        batcher.results_ttl = 0
+        batcher._results.clear()
+        await batcher.submit("Dentists", "Boston", 3)
+        await batcher.submit("Dentists", "Boston", 3)
+        return first, again
+
+    first, again = asyncio.run(run())
+
+    assert first == again
+    assert first[1] == "fast"  # the model is cached with the queries
+    assert claude.calls == 3  # one cached hit, then expired entries are regenerated
+
+
+def test_results_are_keyed_on_serp_context():
+    claude = FakeClaude()
+    batcher = QueryBatcher(claude)
+
+    async def run():
+        await batcher.submit("Dentists", "Boston", 3)
+        await batcher.submit("Dentists", "Boston", 3, serp_context={"primary_business_types": ["Dental Clinic"]})
+
+    asyncio.run(run())
+
+    assert claude.calls == 2
+
+
+def test_short_results_are_not_cached():
+    claude = FakeClaude(short=True)
+    batcher = QueryBatcher(claude)
+
+    async def run():
+        await batcher.submit("Dentists", "Boston", 5)
+        await batcher.submit("Dentists", "Boston", 5)
+
+    asyncio.run(run())
+
+    assert claude.calls == 2
+    assert not batcher._results
+
+
+def test_lru_evicts_oldest():
+    batcher = QueryBatcher(FakeClaude())
+    batcher.results_max = 2
+
+    async def run():
+        for industry in ("a", "b", "c"):
+            await batcher.submit(industry, "Boston", 1)
+
+    asyncio.run(run())
+
+    assert [key[0] for key in batcher._results] == ["b", "c"]
+
+
+def test_stop_cancels_in_flight_generations():
+    class SlowClaude(FakeClaude):
+        async def generate_queries_with_model(self, *args, **kwargs):
+            await asyncio.sleep(60)
+
+    batcher = QueryBatcher(SlowClaude())
+
+    async def run():
+        await batcher.start()
+        request = asyncio.ensure_future(batcher.submit("Dentists", "Boston", 3))
+        await asyncio.sleep(0.1)
+        await batcher.stop()
+        return request, list(batcher._in_flight)
+
+    request, in_flight = asyncio.run(run())
+
+    assert request.cancelled()
+    assert not in_flight
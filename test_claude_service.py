@@ -0,0 +1,21 @@
+import re
+
+from services.claude_service import ClaudeService, _FALLBACK_EMAIL_DOMAINS, _FALLBACK_TLDS
+
+
+def test_fallback_returns_top_k_past_unique_combinations():
+    queries = ClaudeService()._generate_fallback_queries("Dentists", "Boston", 100)
+
+    assert len(queries) == 100
+    assert len(set(queries)) == 31  # every distinct combination before cycling
+
+
+def test_fallback_spreads_providers_and_tlds():
+    queries = ClaudeService()._generate_fallback_queries("Dentists", "Boston", 10)
+
+    providers = {m for q in queries for m in re.findall(r'"(@[\w.]+)"', q)}
+    tlds = {m for q in queries for m in re.findall(r"site:\.(\w+)", q)}
+
+    assert len(queries) == 10
+    assert providers == set(_FALLBACK_EMAIL_DOMAINS)
+    assert tlds == {tld.lstrip(".") for tld in _FALLBACK_TLDS}
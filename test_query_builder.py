@@ -0,0 +1,47 @@
+from models import QueryRequest
+from services.query_builder import QueryBuilderService, request_filter
+
+
+def test_post_process_keeps_top_k_distinct_queries():
+    queries = [
+        'site:.com "dentist" "Boston" "@gmail.com"',
+        'site:.com "pediatric dentist" "Boston" "@yahoo.com"',
+        'site:.org "dental clinic" "Back Bay" "@yahoo.com"',
+        '"pediatric dentist" "Cambridge" "@gmail.com"',
+        '"cosmetic dentist" "Boston" "@outlook.com" -linkedin',
+        '"family dentistry" "Somerville" contact email',
+        'intitle:"dentist" "Boston" "@hotmail.com"',
+        '"dental practice owner" "Boston" "@gmail.com"',
+        'site:.net "oral surgeon" "Brookline" "@aol.com"',
+        '"endodontist" "Boston" "@live.com" -jobs',
+    ]
+    request = QueryRequest(industry="Dentists", region="Boston", top_k=10)
+
+    result = QueryBuilderService()._post_process_queries(queries, request)
+
+    assert result == queries
+
+
+def test_post_process_drops_provider_only_variants():
+    queries = [
+        'site:.com "dentist" "Boston" "@gmail.com"',
+        'site:.com "dentist" "Boston" "@yahoo.com"',
+    ]
+    request = QueryRequest(industry="Dentists", region="Boston", top_k=10)
+
+    result = QueryBuilderService()._post_process_queries(queries, request)
+
+    assert result == queries[:1]
+
+
+def test_request_filter_applies_personal_only_includes_and_excludes():
+    request = QueryRequest(
+        industry="Dentists", region="Boston", top_k=10,
+        includes=["Dentist"], excludes=["yelp.com"], personal_only=True
+    )
+    apply_filters = request_filter(request)
+
+    assert apply_filters('"dentist" "Boston" "@gmail.com"') == '"dentist" "Boston" "@gmail.com" -site:yelp.com'
+    assert apply_filters('"dentist" "Boston" contact email') is None
+    assert apply_filters('"pediatric dentist" "Boston" "@yahoo.com"') == '"pediatric dentist" "Boston" "@yahoo.com" -site:yelp.com'
+    assert apply_filters('"plumber" "Boston" "@gmail.com"') is None